@@ -0,0 +1,486 @@
+import argparse
+import asyncio
+import glob
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.request import BaseRequest
+
+import database
+import voice
+
+# Замер времени вызова корутины (в миллисекундах, медиана по повторам)
+async def measure(func, *args, repeats=50):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await func(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+# Заполнение базы синтетическими задачами одним запросом
+async def populate(task_count, user_count):
+    async with database._write() as db:
+        await db.execute(f'''
+            WITH RECURSIVE seq(n) AS (
+                SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {user_count}
+            )
+            INSERT INTO users (chat_id, username)
+            SELECT n, 'user' || n FROM seq
+        ''')
+        await db.execute(f'''
+            WITH RECURSIVE seq(n) AS (
+                SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {task_count}
+            )
+            INSERT INTO tasks (sender_id, receiver_id, task_text, status)
+            SELECT
+                abs(random()) % {user_count} + 1,
+                abs(random()) % {user_count} + 1,
+                'Задача №' || n,
+                CASE abs(random()) % 4
+                    WHEN 0 THEN 'pending'
+                    WHEN 1 THEN 'accepted'
+                    WHEN 2 THEN 'rejected'
+                    ELSE 'completed'
+                END
+            FROM seq
+        ''')
+
+# Горячие запросы бота по индексам tasks на случайном пользователе
+# (страницы списков — по 11 строк, как в боте)
+async def hot_queries(user_count, repeats):
+    user_id = random.randint(1, user_count)
+    return {
+        'get_tasks_for_user': await measure(database.get_tasks_for_user, user_id, repeats=repeats),
+        'get_assigned_tasks': await measure(database.get_assigned_tasks, user_id, repeats=repeats),
+        'get_open_tasks': await measure(database.get_open_tasks, user_id, 11, repeats=repeats),
+        'get_active_tasks': await measure(database.get_active_tasks, user_id, 11, repeats=repeats),
+        'get_latest_pending_task': await measure(database.get_latest_pending_task, user_id, repeats=repeats),
+    }
+
+# Индексы таблицы tasks (имя и CREATE-запрос) в текущей схеме
+async def task_indexes():
+    async with database._read() as db:
+        cursor = await db.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'tasks' AND sql IS NOT NULL"
+        )
+        return await cursor.fetchall()
+
+# Сравнение времени запросов без индексов по задачам и с ними.
+# Схема полная (task_stats и остальные таблицы на месте), убираются только индексы tasks
+async def bench_indexes(args):
+    for task_count in args.sizes:
+        user_count = max(1, task_count // args.tasks_per_user)
+        with tempfile.TemporaryDirectory() as tmp:
+            await database.open_db(os.path.join(tmp, 'bench.db'))
+            try:
+                await database.migrate()
+                indexes = await task_indexes()
+                async with database._write() as db:
+                    for name, _ in indexes:
+                        await db.execute(f'DROP INDEX {name}')
+                await populate(task_count, user_count)
+                before = await hot_queries(user_count, args.repeats)
+                started = time.perf_counter()
+                async with database._write() as db:
+                    for _, sql in indexes:
+                        await db.execute(sql)
+                index_time = time.perf_counter() - started
+                after = await hot_queries(user_count, args.repeats)
+            finally:
+                await database.close_db()
+
+        print(f"\n📊 {task_count} задач, {user_count} пользователей (построение индексов: {index_time:.2f} с)")
+        print(f"{'запрос':<30}{'без индексов, мс':>18}{'с индексами, мс':>18}")
+        for name in before:
+            print(f"{name:<30}{before[name]:>18.3f}{after[name]:>18.3f}")
+
+# Прежний подход: вся история пользователя и фильтрация в Python
+async def open_tasks_in_python(user_id):
+    return [task for task in await database.get_tasks_for_user(user_id) if task['status'] != 'completed'][:11]
+
+async def latest_pending_in_python(user_id):
+    pending = [task for task in await database.get_tasks_for_user(user_id) if task['status'] == 'pending']
+    return pending[-1] if pending else None
+
+# Фильтрация по статусу в Python и в SQL на пользователе с большой историей
+async def bench_status_filter(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        await database.open_db(os.path.join(tmp, 'bench.db'))
+        try:
+            await database.migrate()
+            await populate(args.history, 1)
+            # Большая часть истории — завершённые задачи
+            async with database._write() as db:
+                await db.execute(f"UPDATE tasks SET status = 'completed' WHERE id % {args.open_every} != 0")
+
+            rows_python = len(await database.get_tasks_for_user(1))
+            rows_sql = len(await database.get_open_tasks(1, limit=11))
+            results = {
+                'Мои задачи (стр. 1)': (
+                    await measure(open_tasks_in_python, 1, repeats=args.repeats),
+                    await measure(database.get_open_tasks, 1, 11, repeats=args.repeats),
+                ),
+                'последняя ожидающая': (
+                    await measure(latest_pending_in_python, 1, repeats=args.repeats),
+                    await measure(database.get_latest_pending_task, 1, repeats=args.repeats),
+                ),
+            }
+        finally:
+            await database.close_db()
+
+    print(f"\n📊 История {args.history} задач, открыта каждая {args.open_every}-я")
+    print(f"Строк из базы на страницу: Python {rows_python}, SQL {rows_sql}")
+    print(f"{'запрос':<25}{'Python, мс':>14}{'SQL, мс':>14}")
+    for name, (python_ms, sql_ms) in results.items():
+        print(f"{name:<25}{python_ms:>14.3f}{sql_ms:>14.3f}")
+
+# Синтетическое голосовое (OGG/Opus) для замеров, если файл не указан
+def synthetic_voice(seconds):
+    result = subprocess.run(
+        [voice.FFMPEG_BINARY, "-loglevel", "error", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+         "-c:a", "libopus", "-f", "ogg", "pipe:1"],
+        capture_output=True, check=True,
+    )
+    return result.stdout
+
+# Прежний путь: .ogg на диск, ffmpeg пишет .wav на диск, чтение .wav обратно
+def convert_via_disk(ogg_bytes, tmp):
+    ogg_path = os.path.join(tmp, "voice.ogg")
+    wav_path = os.path.join(tmp, "voice.wav")
+    with open(ogg_path, "wb") as f:
+        f.write(ogg_bytes)
+    subprocess.run([voice.FFMPEG_BINARY, "-loglevel", "error", "-y", "-i", ogg_path, wav_path], check=True)
+    with open(wav_path, "rb") as f:
+        return f.read()
+
+# Сравнение конвертации голосового через файлы и в памяти
+async def bench_convert(args):
+    if args.file:
+        with open(args.file, "rb") as f:
+            ogg_bytes = f.read()
+    else:
+        ogg_bytes = synthetic_voice(args.seconds)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        disk = await measure(asyncio.to_thread, convert_via_disk, ogg_bytes, tmp, repeats=args.repeats)
+        written = len(ogg_bytes) + os.path.getsize(os.path.join(tmp, "voice.wav"))
+    memory = await measure(asyncio.to_thread, voice.convert_to_pcm, ogg_bytes, repeats=args.repeats)
+
+    print(f"\n🎙️ Голосовое {len(ogg_bytes)} байт, {args.repeats} повторов")
+    print(f"{'через файлы':<20}{disk:>10.2f} мс, на диск записано {written} байт за сообщение")
+    print(f"{'в памяти':<20}{memory:>10.2f} мс, на диск записано 0 байт")
+
+# Распознавание набора клипов одним движком: RTF и пропускная способность
+async def bench_speech(args):
+    paths = sorted(
+        path for path in glob.glob(os.path.join(args.clips, "*"))
+        if os.path.splitext(path)[1].lower() in (".ogg", ".oga", ".opus", ".wav", ".mp3")
+    )
+    if not paths:
+        raise SystemExit(f"В {args.clips} нет аудиофайлов")
+    clips = []
+    for path in paths:
+        with open(path, "rb") as f:
+            pcm = voice.convert_to_pcm(f.read())
+        clips.append((os.path.basename(path), pcm))
+    audio_seconds = sum(len(pcm) for _, pcm in clips) / (voice.SAMPLE_RATE * voice.SAMPLE_WIDTH)
+    print(f"\n🎧 {len(clips)} клипов, {audio_seconds:.1f} с аудио, потоков: {args.workers}")
+
+    for name in args.backends:
+        backend = voice.create_backend(name, vosk_model_path=args.vosk_model)
+        started = time.perf_counter()
+        await asyncio.to_thread(backend.load)
+        load_time = time.perf_counter() - started
+
+        async def run(clip, semaphore):
+            clip_name, pcm = clip
+            async with semaphore:
+                clip_started = time.perf_counter()
+                try:
+                    text = await asyncio.to_thread(backend.transcribe, pcm)
+                except voice.UnrecognizedSpeech:
+                    text = ""
+                if args.verbose:
+                    print(f"  {clip_name}: {time.perf_counter() - clip_started:.2f} с — {text}")
+                return time.perf_counter() - clip_started
+
+        semaphore = asyncio.Semaphore(args.workers)
+        started = time.perf_counter()
+        durations = await asyncio.gather(*(run(clip, semaphore) for clip in clips))
+        wall = time.perf_counter() - started
+
+        print(f"{name}: загрузка {load_time:.2f} с, RTF {sum(durations) / audio_seconds:.3f}, "
+              f"{len(clips) / wall:.2f} клипов/с, {audio_seconds / wall:.1f} с аудио/с")
+
+# Транспорт Bot API без сети: отвечает как Telegram, latency — имитация задержки сети
+class FakeRequest(BaseRequest):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif endpoint in ("sendMessage", "editMessageText"):
+            result = {
+                "message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"}, "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+# Синтетические апдейты (id апдейтов сквозные на весь прогон)
+LOAD_USER_BASE = 1_000_000
+_update_ids = itertools.count(1)
+
+def synthetic_message(bot, chat_id, text=None, **fields):
+    update_id = next(_update_ids)
+    message = {
+        "message_id": update_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "user", "username": f"user{chat_id}"}, **fields,
+    }
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return Update.de_json({"update_id": update_id, "message": message}, bot)
+
+def synthetic_callback(bot, chat_id, data):
+    update_id = next(_update_ids)
+    return Update.de_json({"update_id": update_id, "callback_query": {
+        "id": str(update_id), "chat_instance": str(chat_id), "data": data,
+        "from": {"id": chat_id, "is_bot": False, "first_name": "user"},
+        "message": {"message_id": update_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "text": "…"},
+    }}, bot)
+
+# Сценарий пользователя: регистрация, задача себе, задача соседу, списки, ответ на задачу, статистика
+def user_scenario(bot, chat_id, peer_id):
+    return [
+        synthetic_message(bot, chat_id, "/start"),
+        synthetic_message(bot, chat_id, contact={"phone_number": f"+{chat_id}", "first_name": "user", "user_id": chat_id}),
+        synthetic_message(bot, chat_id, "➕ Поставить себе"),
+        synthetic_message(bot, chat_id, f"Задача пользователя {chat_id}"),
+        synthetic_message(bot, chat_id, "📋 Мои задачи"),
+        synthetic_message(bot, chat_id, "📤 Поставить другому"),
+        synthetic_callback(bot, chat_id, f"pick:{peer_id}"),
+        synthetic_callback(bot, chat_id, "pick_done"),
+        synthetic_message(bot, chat_id, f"Задача от {chat_id}"),
+        synthetic_message(bot, chat_id, "📄 Отправленные задачи"),
+        synthetic_message(bot, chat_id, "✅ Принять"),
+        synthetic_message(bot, chat_id, "📈 Моя статистика"),
+    ]
+
+# Прогон: concurrency клиентов, каждый шлёт апдейты своих пользователей по одному
+# и ждёт окончания обработки (с burst — весь сценарий пользователя сразу).
+# Задержка — от постановки в очередь приложения до завершения всех обработчиков
+# (отмечает TypeHandler в последней группе). update_concurrency — лимит приложения
+async def run_load(bot, args, update_concurrency):
+    request = FakeRequest(args.api_latency / 1000)
+    app = bot.build_application(request=request, concurrency=update_concurrency)
+    concurrency = min(args.concurrency, args.users)
+    loop = asyncio.get_running_loop()
+    waiting = {}
+    latencies = []
+    errors = []
+    sent = itertools.count()
+
+    async def finished(update, context):
+        future = waiting.pop(update.update_id, None)
+        if future is not None:
+            future.set_result(time.perf_counter())
+
+    async def failed(update, context):
+        errors.append(context.error)
+
+    async def submit(update):
+        future = waiting[update.update_id] = loop.create_future()
+        started = time.perf_counter()
+        await app.update_queue.put(update)
+        latencies.append(await future - started)
+
+    async def client(index):
+        for user in itertools.cycle(range(index, args.users, concurrency)):
+            chat_id = LOAD_USER_BASE + user
+            scenario = user_scenario(app.bot, chat_id, LOAD_USER_BASE + (user + 1) % args.users)
+            scenario = [update for update in scenario if next(sent) < args.updates]
+            if not scenario:
+                return
+            if args.burst:
+                await asyncio.gather(*(submit(update) for update in scenario))
+            else:
+                for update in scenario:
+                    await submit(update)
+
+    app.add_handler(TypeHandler(Update, finished), group=100)
+    app.add_error_handler(failed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        await database.open_db(os.path.join(tmp, "load.db"))
+        await database.init_db()
+        async with database._write() as db:
+            await db.executemany(
+                "INSERT INTO users (chat_id, username) VALUES (?, ?)",
+                [(LOAD_USER_BASE + user, f"user{LOAD_USER_BASE + user}") for user in range(args.users)],
+            )
+        await app.initialize()
+        await app.post_init(app)
+        await app.start()
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(client(index) for index in range(concurrency)))
+            wall = time.perf_counter() - started
+        finally:
+            await app.stop()
+            await app.post_stop(app)
+            await app.shutdown()
+            await app.post_shutdown(app)
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        'update_concurrency': update_concurrency,
+        'updates': len(latencies),
+        'rate': len(latencies) / wall,
+        'p50': percentiles[49] * 1000,
+        'p99': percentiles[98] * 1000,
+        'max': max(latencies) * 1000,
+        'errors': errors,
+        'api_calls': request.calls,
+    }
+
+# Нагрузочный тест приложения из bot.py: пропускная способность и задержки обработки
+async def bench_load(args):
+    # bot.py читает настройки при импорте: без сети и без лимитов исходящих сообщений
+    os.environ.setdefault("TOKEN", "1:bench")
+    os.environ.setdefault("OPENWEATHER_API_KEY", "bench")
+    os.environ.setdefault("NOTIFY_RATE", "1000000")
+    os.environ.setdefault("NOTIFY_CHAT_INTERVAL", "0")
+    import bot
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"\n🚦 {args.updates} апдейтов, {args.users} пользователей, клиентов: {min(args.concurrency, args.users)}, "
+          f"задержка Bot API {args.api_latency} мс{', сценарии пачкой' if args.burst else ''}")
+    print(f"{'параллельно':>12}{'апдейтов/с':>12}{'p50, мс':>10}{'p99, мс':>10}{'max, мс':>10}{'Bot API':>10}{'ошибок':>8}")
+    for update_concurrency in args.concurrent_updates:
+        result = await run_load(bot, args, update_concurrency)
+        print(f"{update_concurrency:>12}{result['rate']:>12.0f}{result['p50']:>10.2f}{result['p99']:>10.2f}"
+              f"{result['max']:>10.2f}{result['api_calls']:>10}{len(result['errors']):>8}")
+        if result['errors']:
+            print(f"❗ первая ошибка: {result['errors'][0]!r}")
+
+# Поток записей задач: writers параллельных «пользователей», каждый добавляет задачу
+# и сразу меняет её статус; сравнение коммита на каждую операцию и пакетной записи
+async def bench_write_batch(args):
+    print(f"\n💾 {args.writers} писателей × {args.ops} операций, synchronous={args.synchronous}")
+    print(f"{'окно, мс':>10}{'операций/с':>14}{'коммитов':>10}{'операций/коммит':>17}{'p50, мс':>10}")
+    for window in args.windows:
+        with tempfile.TemporaryDirectory() as tmp:
+            await database.open_db(os.path.join(tmp, "write.db"))
+            database.WRITE_BATCH_MS = window
+            try:
+                await database.migrate()
+                await database._writer.execute(f"PRAGMA synchronous={args.synchronous}")
+                commits = 0
+                commit = database._writer.commit
+
+                async def counting_commit():
+                    nonlocal commits
+                    commits += 1
+                    await commit()
+
+                database._writer.commit = counting_commit
+                latencies = []
+
+                async def writer(user_id):
+                    for number in range(args.ops // 2):
+                        started = time.perf_counter()
+                        task_id = await database.add_task(user_id, user_id, f"Задача {number}")
+                        await database.update_task_status_by_id(user_id, task_id, "accepted", old_status="pending")
+                        latencies.append((time.perf_counter() - started) / 2)
+
+                started = time.perf_counter()
+                await asyncio.gather(*(writer(user_id) for user_id in range(1, args.writers + 1)))
+                wall = time.perf_counter() - started
+                operations = len(latencies) * 2
+            finally:
+                await database.close_db()
+        print(f"{window:>10g}{operations / wall:>14.0f}{commits:>10}{operations / max(commits, 1):>17.1f}"
+              f"{statistics.median(latencies) * 1000:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки бота задач")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    indexes = subparsers.add_parser("indexes", help="запросы к tasks до и после индексов")
+    indexes.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    indexes.add_argument("--tasks-per-user", type=int, default=100)
+    indexes.add_argument("--repeats", type=int, default=50)
+    indexes.set_defaults(func=bench_indexes)
+
+    status_filter = subparsers.add_parser("status-filter", help="фильтрация по статусу: Python против SQL")
+    status_filter.add_argument("--history", type=int, default=100_000)
+    status_filter.add_argument("--open-every", type=int, default=20)
+    status_filter.add_argument("--repeats", type=int, default=20)
+    status_filter.set_defaults(func=bench_status_filter)
+
+    convert = subparsers.add_parser("convert", help="конвертация голосового: файлы против памяти")
+    convert.add_argument("--file", help="OGG/Opus файл (по умолчанию синтетический сигнал)")
+    convert.add_argument("--seconds", type=int, default=10)
+    convert.add_argument("--repeats", type=int, default=20)
+    convert.set_defaults(func=bench_convert)
+
+    speech = subparsers.add_parser("speech", help="скорость движков распознавания на наборе клипов")
+    speech.add_argument("clips", help="каталог с голосовыми (ogg/opus/wav/mp3)")
+    speech.add_argument("--backends", nargs="+", default=list(voice.BACKENDS), choices=list(voice.BACKENDS))
+    speech.add_argument("--vosk-model", default=os.getenv("VOSK_MODEL_PATH"))
+    speech.add_argument("--workers", type=int, default=1)
+    speech.add_argument("--verbose", action="store_true")
+    speech.set_defaults(func=bench_speech)
+
+    load = subparsers.add_parser("load", help="нагрузочный тест обработчиков на синтетических апдейтах")
+    load.add_argument("--updates", type=int, default=5000)
+    load.add_argument("--users", type=int, default=200)
+    load.add_argument("--concurrency", type=int, default=50)
+    load.add_argument("--api-latency", type=float, default=0, help="задержка ответа Bot API, мс")
+    load.add_argument("--concurrent-updates", type=int, nargs="+", default=[1, 4, 16, 64],
+                      help="лимиты параллельной обработки апдейтов для сравнения")
+    load.add_argument("--burst", action="store_true", help="отправлять сценарий пользователя целиком, не дожидаясь ответов")
+    load.set_defaults(func=bench_load)
+
+    write_batch = subparsers.add_parser("write-batch", help="запись задач: коммит на операцию против пакетной записи")
+    write_batch.add_argument("--writers", type=int, default=50)
+    write_batch.add_argument("--ops", type=int, default=40, help="операций на писателя")
+    write_batch.add_argument("--windows", type=float, nargs="+", default=[0, 2, 5, 10], help="окна группировки, мс (0 — без неё)")
+    write_batch.add_argument("--synchronous", choices=["OFF", "NORMAL", "FULL", "EXTRA"], default=database.SYNCHRONOUS)
+    write_batch.set_defaults(func=bench_write_batch)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,32 @@
+import asyncio
 import logging 
 import os
-import aiohttp
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ConversationHandler, ContextTypes, filters
+import time
+import warnings
+from zoneinfo import ZoneInfo
+from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, ConversationHandler, ContextTypes, filters
+from telegram.warnings import PTBUserWarning
 from dotenv import load_dotenv
-import database
 
-# Загрузка переменных окружения
+# Загрузка переменных окружения (до импорта модулей, которые читают настройки при импорте)
 load_dotenv()
+
+import database
+import metrics
+from weather import WeatherService, OPENWEATHER_URL
+from notifier import Notifier
+from persistence import SQLitePersistence
+from reminders import ReminderScheduler, load_checklist, parse_slot
+from voice import TranscriptionQueue, UnrecognizedSpeech, create_backend, transcribe
+from update_processor import ChatOrderedUpdateProcessor
+
 TOKEN = os.getenv("TOKEN")
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
 ADMIN_CHAT_ID = 838476401
+STARTUP_TIMEOUT = float(os.getenv("STARTUP_TIMEOUT", "30"))
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+WEATHER_CITY = "Saint Petersburg"
 
 # Проверка переменных
 if not TOKEN or not OPENWEATHER_API_KEY:
@@ -22,9 +38,8 @@ logging.basicConfig(level=logging.INFO)
 # Состояния для ConversationHandler
 (WRITING_SELF_TASK, CHOOSING_USER, WRITING_USER_TASK,
  CHOOSING_TASK_TO_COMPLETE, CONFIRM_COMPLETION,
- CHOOSING_TASK_TO_DELETE, CONFIRM_DELETION) = range(7)
-
-user_data_buffer = {}
+ CHOOSING_TASK_TO_DELETE, CONFIRM_DELETION,
+ WRITING_BROADCAST, WRITING_REMINDER_TIME, CONFIRM_BROADCAST) = range(10)
 
 # Главное меню
 def main_keyboard(is_admin=False):
@@ -33,12 +48,30 @@ def main_keyboard(is_admin=False):
         [KeyboardButton("📋 Мои задачи"), KeyboardButton("📄 Отправленные задачи")],
         [KeyboardButton("✅ Завершить задачу"), KeyboardButton("🗑️ Удалить задачу")],
         [KeyboardButton("📈 Моя статистика"), KeyboardButton("🎙️ Голосом"), KeyboardButton("🌦️ Погода")],
-        [KeyboardButton("📞 Поделиться контактом")]
+        [KeyboardButton("⏰ Напоминания"), KeyboardButton("📞 Поделиться контактом")]
     ]
     if is_admin:
-        keyboard.append([KeyboardButton("👑 Админка")])
+        keyboard.append([KeyboardButton("👑 Админка"), KeyboardButton("📢 Рассылка")])
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
+MENU_BUTTONS = {button.text for row in main_keyboard(is_admin=True).keyboard for button in row}
+
+# Замер времени обработчика (метка handler — имя функции)
+def timed_handler(func):
+    return metrics.timed(metrics.HANDLER_SECONDS, handler=func.__name__)(func)
+
+# Для главного меню метка — нажатая кнопка
+def menu_branch(update, context):
+    text = update.message.text
+    return f"main_menu:{text}" if text in MENU_BUTTONS else "main_menu"
+
+# Принять/Отклонить клавиатура для конкретной задачи
+def accept_reject_keyboard(task_id):
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton("✅ Принять", callback_data=f"accept:{task_id}"),
+          InlineKeyboardButton("❌ Отклонить", callback_data=f"reject:{task_id}")]]
+    )
+
 # Да/Нет клавиатура
 def yes_no_keyboard():
     return ReplyKeyboardMarkup(
@@ -46,26 +79,138 @@ def yes_no_keyboard():
         resize_keyboard=True
     )
 
+# Постраничный вывод: задач на странице и длина текста задачи в списке/на кнопке,
+# чтобы страница гарантированно помещалась в лимит Telegram (4096 символов)
+PAGE_SIZE = 10
+TASK_PREVIEW_LENGTH = 300
+BUTTON_TEXT_LENGTH = 40
+
+def shorten(text, limit):
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+# Инлайн-клавиатура страницы: кнопки элементов и навигация ◀️/▶️ (None, если пусто)
+def page_markup(buttons, prefix, page, has_next):
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️", callback_data=f"{prefix}:{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("▶️", callback_data=f"{prefix}:{page + 1}"))
+    rows = buttons + [nav] if nav else buttons
+    return InlineKeyboardMarkup(rows) if rows else None
+
+# Страница «Мои задачи»
+async def my_tasks_page(chat_id, page):
+    tasks = await database.get_open_tasks(chat_id, limit=PAGE_SIZE + 1, offset=page * PAGE_SIZE)
+    markup = page_markup([], "my", page, len(tasks) > PAGE_SIZE)
+    if not tasks:
+        return "🎯 Нет задач.", markup
+    msg = "\n".join(f"📝 {shorten(task['task_text'], TASK_PREVIEW_LENGTH)} ({task['status']})" for task in tasks[:PAGE_SIZE])
+    return f"📋 Ваши задачи (стр. {page + 1}):\n{msg}", markup
+
+# Страница «Отправленные задачи»
+async def sent_tasks_page(chat_id, page):
+    tasks = await database.get_assigned_tasks(chat_id, limit=PAGE_SIZE + 1, offset=page * PAGE_SIZE)
+    markup = page_markup([], "sent", page, len(tasks) > PAGE_SIZE)
+    if not tasks:
+        return "📭 Вы никому не поставили задачи.", markup
+    msg = "\n".join(
+        f"📤 {shorten(task['task_text'], TASK_PREVIEW_LENGTH)} → @{task['receiver_username']} ({task['status']})"
+        for task in tasks[:PAGE_SIZE]
+    )
+    return f"📄 Отправленные задачи (стр. {page + 1}):\n{msg}", markup
+
+# Страница выбора задачи для завершения (action="complete") или удаления (action="delete")
+async def task_picker(chat_id, action, page):
+    fetch = database.get_active_tasks if action == "complete" else database.get_tasks_for_user
+    tasks = await fetch(chat_id, limit=PAGE_SIZE + 1, offset=page * PAGE_SIZE)
+    buttons = [
+        [InlineKeyboardButton(shorten(task['task_text'], BUTTON_TEXT_LENGTH), callback_data=f"{action}:{task['id']}")]
+        for task in tasks[:PAGE_SIZE]
+    ]
+    return page_markup(buttons, f"{action}_page", page, len(tasks) > PAGE_SIZE)
+
+# Страница выбора получателей: поиск по началу имени, отмеченные помечаются галочкой
+async def recipient_picker(chat_id, selected, query, page):
+    contacts = await database.search_contacts(query, limit=PAGE_SIZE + 1, offset=page * PAGE_SIZE, exclude=chat_id)
+    buttons = [
+        [InlineKeyboardButton(("✅ " if user['chat_id'] in selected else "") + user['username'], callback_data=f"pick:{user['chat_id']}")]
+        for user in contacts[:PAGE_SIZE]
+    ]
+    buttons.append([InlineKeyboardButton(f"➡️ Готово ({len(selected)})", callback_data="pick_done")])
+    return page_markup(buttons, "pick_page", page, len(contacts) > PAGE_SIZE)
+
+def recipient_picker_text(query):
+    if query:
+        return f"🔎 Пользователи на «{query}». Выберите получателей и нажмите «Готово»:"
+    return "👥 Выберите получателей и нажмите «Готово».\nДля поиска напишите начало имени:"
+
+# Статистика: подписи статусов и сводка по счётчикам
+STATUS_LABELS = {
+    "pending": "⏳ ожидают",
+    "accepted": "👍 приняты",
+    "rejected": "❌ отклонены",
+    "completed": "🏁 завершены",
+}
+
+def format_stats(stats):
+    lines = ["📊 Ваша статистика"]
+    for role, title in (("received", "📥 Получено"), ("sent", "📤 Поставлено")):
+        by_status = stats[role]
+        lines.append(f"\n{title}: {sum(by_status.values())}")
+        lines += [f"  {label}: {by_status[status]}" for status, label in STATUS_LABELS.items() if by_status.get(status)]
+    received = sum(stats["received"].values())
+    if received:
+        completed = stats["received"].get("completed", 0)
+        lines.append(f"\n🎯 Выполнено: {completed} из {received} ({completed / received:.0%})")
+    return "\n".join(lines)
+
+# Исходящие уведомления и рассылки (очередь с учётом лимитов Telegram)
+notifier = Notifier(
+    global_rate=float(os.getenv("NOTIFY_RATE", "25")),
+    chat_interval=float(os.getenv("NOTIFY_CHAT_INTERVAL", "1")),
+)
+
+# Ежедневные напоминания по чек-листу (чек-лист читается один раз при запуске)
+reminder_scheduler = ReminderScheduler(
+    load_checklist(os.getenv("CHECKLIST_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "checklist.txt"))),
+    notifier,
+    ZoneInfo(os.getenv("REMINDER_TIMEZONE", "Europe/Moscow")),
+)
+
 # Погода
+weather_service = WeatherService(
+    OPENWEATHER_API_KEY,
+    base_url=os.getenv("OPENWEATHER_URL", OPENWEATHER_URL),
+    ttl=float(os.getenv("WEATHER_CACHE_TTL", "600")),
+    stale_ttl=float(os.getenv("WEATHER_STALE_TTL", "3600")),
+    timeout=float(os.getenv("WEATHER_TIMEOUT", "5")),
+)
+
 async def get_weather():
     try:
-        async with aiohttp.ClientSession() as session:
-            url = f"http://api.openweathermap.org/data/2.5/weather?q=Saint Petersburg&appid={OPENWEATHER_API_KEY}&units=metric&lang=ru"
-            async with session.get(url) as response:
-                if response.status != 200:
-                    raise Exception(f"Ошибка погоды: код {response.status}")
-                data = await response.json()
-                temp = data['main']['temp']
-                description = data['weather'][0]['description']
-                wind = data['wind']['speed']
-                return f"🌍 Санкт-Петербург\n🌡️ {temp}°C\n☁️ {description}\n🌬️ {wind} м/с"
+        weather = await weather_service.get(WEATHER_CITY)
+        return f"🌍 Санкт-Петербург\n🌡️ {weather['temp']}°C\n☁️ {weather['description']}\n🌬️ {weather['wind']} м/с"
     except Exception as e:
         logging.error(f"Ошибка получения погоды: {e}")
         return "❗ Ошибка получения погоды."
 
+# Движок и очередь распознавания голосовых сообщений
+speech_backend = create_backend(
+    os.getenv("SPEECH_BACKEND", "google"),
+    vosk_model_path=os.getenv("VOSK_MODEL_PATH"),
+)
+transcription_queue = TranscriptionQueue(
+    workers=int(os.getenv("VOICE_WORKERS", "2")),
+    max_size=int(os.getenv("VOICE_QUEUE_SIZE", "20")),
+)
+
+# Длина очередей читается в момент запроса метрик
+metrics.Gauge("notifier_pending_messages", "Сообщения в очереди на отправку", func=lambda: notifier.pending)
+metrics.Gauge("voice_queue_pending", "Голосовые в очереди на распознавание", func=lambda: transcription_queue.pending)
+
 # /start
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await database.init_db()
     chat_id = update.message.chat_id
     username = update.message.from_user.username or "NoName"
     await database.add_user(chat_id, username, None)
@@ -78,6 +223,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 # Контакт
+@timed_handler
 async def contact_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     contact = update.message.contact
     chat_id = update.message.chat_id
@@ -91,6 +237,7 @@ async def contact_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 # Главное меню
+@metrics.timed(metrics.HANDLER_SECONDS, handler=menu_branch)
 async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     chat_id = update.message.chat_id
@@ -101,56 +248,41 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return WRITING_SELF_TASK
 
     elif text == "📤 Поставить другому":
-        contacts = await database.get_all_contacts()
-        buttons = [[KeyboardButton(user['username'])] for user in contacts if user['chat_id'] != chat_id]
-        context.user_data['contacts'] = {user['username']: user['chat_id'] for user in contacts}
-        if buttons:
-            await update.message.reply_text("👥 Выберите пользователя:", reply_markup=ReplyKeyboardMarkup(buttons, resize_keyboard=True))
+        if await database.search_contacts(limit=1, exclude=chat_id):
+            context.user_data.update(receiver_ids=[], recipient_query="", recipient_page=0)
+            markup = await recipient_picker(chat_id, [], "", 0)
+            await update.message.reply_text(recipient_picker_text(""), reply_markup=markup)
             return CHOOSING_USER
         else:
             await update.message.reply_text("❗ Нет других пользователей.", reply_markup=main_keyboard(is_admin))
 
     elif text == "📋 Мои задачи":
-        tasks = await database.get_tasks_for_user(chat_id)
-        tasks = [t for t in tasks if t['status'] != 'completed']
-        if not tasks:
-            await update.message.reply_text("🎯 Нет задач.", reply_markup=main_keyboard(is_admin))
-        else:
-            msg = "\n".join([f"📝 {task['task_text']} ({task['status']})" for task in tasks])
-            await update.message.reply_text(f"📋 Ваши задачи:\n{msg}", reply_markup=main_keyboard(is_admin))
+        msg, markup = await my_tasks_page(chat_id, 0)
+        await update.message.reply_text(msg, reply_markup=markup or main_keyboard(is_admin))
 
     elif text == "📄 Отправленные задачи":
-        tasks = await database.get_assigned_tasks(chat_id)
-        if not tasks:
-            await update.message.reply_text("📭 Вы никому не поставили задачи.", reply_markup=main_keyboard(is_admin))
-        else:
-            msg = "\n".join([f"📤 {task['task_text']} → @{task['receiver_username']} ({task['status']})" for task in tasks])
-            await update.message.reply_text(f"📄 Отправленные задачи:\n{msg}", reply_markup=main_keyboard(is_admin))
+        msg, markup = await sent_tasks_page(chat_id, 0)
+        await update.message.reply_text(msg, reply_markup=markup or main_keyboard(is_admin))
 
     elif text == "✅ Завершить задачу":
-        tasks = await database.get_tasks_for_user(chat_id)
-        tasks = [t for t in tasks if t['status'] in ['accepted', 'pending']]
-        if not tasks:
+        markup = await task_picker(chat_id, "complete", 0)
+        if not markup:
             await update.message.reply_text("❗ Нет задач для завершения.", reply_markup=main_keyboard(is_admin))
             return ConversationHandler.END
-        context.user_data['completion_tasks'] = tasks
-        buttons = [[KeyboardButton(task['task_text'])] for task in tasks]
-        await update.message.reply_text("✅ Выберите задачу для завершения:", reply_markup=ReplyKeyboardMarkup(buttons, resize_keyboard=True))
+        await update.message.reply_text("✅ Выберите задачу для завершения:", reply_markup=markup)
         return CHOOSING_TASK_TO_COMPLETE
 
     elif text == "🗑️ Удалить задачу":
-        tasks = await database.get_tasks_for_user(chat_id)
-        if not tasks:
+        markup = await task_picker(chat_id, "delete", 0)
+        if not markup:
             await update.message.reply_text("❗ Нет задач для удаления.", reply_markup=main_keyboard(is_admin))
             return ConversationHandler.END
-        context.user_data['deletion_tasks'] = tasks
-        buttons = [[KeyboardButton(task['task_text'])] for task in tasks]
-        await update.message.reply_text("🗑️ Выберите задачу для удаления:", reply_markup=ReplyKeyboardMarkup(buttons, resize_keyboard=True))
+        await update.message.reply_text("🗑️ Выберите задачу для удаления:", reply_markup=markup)
         return CHOOSING_TASK_TO_DELETE
 
     elif text == "📈 Моя статистика":
-        count = await database.get_task_count(chat_id)
-        await update.message.reply_text(f"📊 Всего задач: {count}", reply_markup=main_keyboard(is_admin))
+        stats = await database.get_user_stats(chat_id)
+        await update.message.reply_text(format_stats(stats), reply_markup=main_keyboard(is_admin))
     
     elif text == "🎙️ Голосом":
         await update.message.reply_text(
@@ -161,6 +293,14 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         weather = await get_weather()
         await update.message.reply_text(weather, reply_markup=main_keyboard(is_admin))
 
+    elif text == "⏰ Напоминания":
+        remind_at = await database.get_reminder(chat_id)
+        current = f"сейчас в {remind_at}" if remind_at else "сейчас выключены"
+        await update.message.reply_text(
+            f"⏰ Ежедневный чек-лист ({current}).\nНапишите время в формате ЧЧ:ММ или «выкл»:"
+        )
+        return WRITING_REMINDER_TIME
+
     elif text == "📞 Поделиться контактом":
         await update.message.reply_text(
             "📞 Поделитесь своим контактом:",
@@ -170,6 +310,10 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         )
 
+    elif text == "📢 Рассылка" and is_admin:
+        await update.message.reply_text("✏️ Напишите текст рассылки для всех пользователей:")
+        return WRITING_BROADCAST
+
     elif text == "👑 Админка" and is_admin:
         users = await database.get_all_contacts()
         msg = "👑 Все пользователи:\n" + "\n".join(f"• @{u['username']} ({u['phone_number']})" for u in users)
@@ -179,6 +323,7 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❓ Команда не распознана. Используйте кнопки меню.", reply_markup=main_keyboard(is_admin))
 
 
+@timed_handler
 async def write_self_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
     task_text = update.message.text
     chat_id = update.message.chat_id
@@ -186,223 +331,454 @@ async def write_self_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("✅ Задача добавлена!", reply_markup=main_keyboard(is_admin=(chat_id == ADMIN_CHAT_ID)))
     return ConversationHandler.END
 
-# Выбираем пользователя
-async def choose_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    selected_username = update.message.text
-    receiver_id = context.user_data.get('contacts', {}).get(selected_username)
-    if not receiver_id:
-        await update.message.reply_text("❗ Пользователь не найден.", reply_markup=main_keyboard())
+# Текст рассылки от администратора: показываем и просим подтвердить
+@timed_handler
+async def write_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.message.chat_id
+    if chat_id != ADMIN_CHAT_ID:
         return ConversationHandler.END
-    context.user_data['receiver_id'] = receiver_id
-    
-    await update.message.reply_text(f"✏️ Напишите текст задачи для @{selected_username}:")
-    return WRITING_USER_TASK
 
-# Пишем задачу другому
-async def write_user_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    task_text = update.message.text
-    sender_id = update.message.chat_id
-    receiver_id = context.user_data.get('receiver_id')
+    text = update.message.text
+    if text.strip() in MENU_BUTTONS:
+        next_state = await main_menu_handler(update, context)
+        return ConversationHandler.END if next_state is None else next_state
 
-    if not receiver_id:
-        await update.message.reply_text("❗ Ошибка: не выбран получатель задачи.", reply_markup=main_keyboard())
+    context.user_data['broadcast_text'] = text
+    await update.message.reply_text(
+        f"📢 Отправить рассылку всем пользователям?\n\n{shorten(text, TASK_PREVIEW_LENGTH)}",
+        reply_markup=yes_no_keyboard()
+    )
+    return CONFIRM_BROADCAST
+
+# Подтверждение рассылки: ставим в очередь всем пользователям
+@timed_handler
+async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.message.chat_id
+    text = context.user_data.pop('broadcast_text', None)
+    if chat_id != ADMIN_CHAT_ID:
         return ConversationHandler.END
 
-    await database.add_task(sender_id, receiver_id, task_text, status="pending")
-    context.user_data.clear()
+    if not text:
+        await update.message.reply_text("❗ Ошибка: текст рассылки не найден.", reply_markup=main_keyboard(is_admin=True))
+        return ConversationHandler.END
 
-    await update.message.reply_text("✅ Задача отправлена!", reply_markup=main_keyboard(is_admin=(sender_id == ADMIN_CHAT_ID)))
+    if update.message.text != "✅ Да":
+        await update.message.reply_text("❌ Рассылка отменена.", reply_markup=main_keyboard(is_admin=True))
+        return ConversationHandler.END
 
-    await context.bot.send_message(
-        chat_id=receiver_id,
-        text=f"📩 Вам поставили новую задачу:\n\n{task_text}",
-        reply_markup=ReplyKeyboardMarkup(
-            [[KeyboardButton("✅ Принять"), KeyboardButton("❌ Отклонить")]],
-            resize_keyboard=True
-        )
-    )
+    contacts = await database.get_all_contacts()
+    deliveries = notifier.broadcast([user['chat_id'] for user in contacts], text)
+    await update.message.reply_text(f"📢 Рассылка поставлена в очередь: {len(deliveries)} получателей.", reply_markup=main_keyboard(is_admin=True))
 
-    # Сохраняем задачу в данных пользователя для дальнейшей обработки
-    if receiver_id not in context.application.user_data:
-        context.application.user_data[receiver_id] = {}
-    context.application.user_data[receiver_id]['pending_task_text'] = task_text
+    # Итог рассылки приходит отдельным сообщением, когда всё доставлено.
+    # Колбэк, а не задача приложения: Application.stop() не ждёт конца рассылки
+    def report(done):
+        delivered = sum(1 for message in done.result() if message is not None)
+        notifier.send(chat_id, f"📢 Рассылка завершена: доставлено {delivered} из {len(deliveries)}.")
 
+    asyncio.gather(*deliveries).add_done_callback(report)
     return ConversationHandler.END
 
+# Настройка времени напоминаний
+@timed_handler
+async def write_reminder_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.message.chat_id
+    text = update.message.text.strip()
+    is_admin = (chat_id == ADMIN_CHAT_ID)
+
+    if text in MENU_BUTTONS:
+        next_state = await main_menu_handler(update, context)
+        return ConversationHandler.END if next_state is None else next_state
+
+    if text.lower() == "выкл":
+        await reminder_scheduler.unsubscribe(chat_id)
+        await update.message.reply_text("🔕 Напоминания выключены.", reply_markup=main_keyboard(is_admin))
+        return ConversationHandler.END
+
+    slot = parse_slot(text)
+    if not slot:
+        await update.message.reply_text("❗ Не понял время. Напишите, например, 08:30 или «выкл»:")
+        return WRITING_REMINDER_TIME
 
-   
-    # Завершаем разговор
+    await reminder_scheduler.subscribe(chat_id, slot)
+    await update.message.reply_text(f"⏰ Каждый день в {slot} пришлю чек-лист.", reply_markup=main_keyboard(is_admin))
     return ConversationHandler.END
 
+# Отмечаем/снимаем получателя (id из кнопки проверяем: callback_data можно подделать)
+@timed_handler
+async def toggle_recipient(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    receiver_id = int(query.data.split(":")[1])
+    if not await database.known_contacts([receiver_id]):
+        await query.answer("Пользователь не найден", show_alert=True)
+        return CHOOSING_USER
+    await query.answer()
+    selected = context.user_data.setdefault('receiver_ids', [])
+    if receiver_id in selected:
+        selected.remove(receiver_id)
+    else:
+        selected.append(receiver_id)
+    markup = await recipient_picker(
+        query.message.chat_id, selected,
+        context.user_data.get('recipient_query', ""), context.user_data.get('recipient_page', 0)
+    )
+    await query.edit_message_reply_markup(markup)
+    return CHOOSING_USER
+
+# Листание списка получателей
+@timed_handler
+async def turn_recipient_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    page = int(query.data.split(":")[1])
+    context.user_data['recipient_page'] = page
+    markup = await recipient_picker(
+        query.message.chat_id, context.user_data.get('receiver_ids', []),
+        context.user_data.get('recipient_query', ""), page
+    )
+    await query.edit_message_reply_markup(markup)
+    return CHOOSING_USER
+
+# Поиск получателей по началу имени; кнопки главного меню работают как обычно
+@timed_handler
+async def search_recipients(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text.strip()
+    if text in MENU_BUTTONS:
+        for key in ('receiver_ids', 'recipient_query', 'recipient_page'):
+            context.user_data.pop(key, None)
+        next_state = await main_menu_handler(update, context)
+        return ConversationHandler.END if next_state is None else next_state
+    search = text.lstrip("@")
+    context.user_data.update(recipient_query=search, recipient_page=0)
+    markup = await recipient_picker(update.message.chat_id, context.user_data.get('receiver_ids', []), search, 0)
+    await update.message.reply_text(recipient_picker_text(search), reply_markup=markup)
+    return CHOOSING_USER
+
+# Получатели выбраны
+@timed_handler
+async def choose_users_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    selected = context.user_data.get('receiver_ids')
+    if not selected:
+        await query.answer("Выберите хотя бы одного получателя", show_alert=True)
+        return CHOOSING_USER
+    await query.answer()
+    context.user_data.pop('recipient_query', None)
+    context.user_data.pop('recipient_page', None)
+    await query.edit_message_text(f"👥 Получателей: {len(selected)}")
+    await query.message.reply_text(f"✏️ Напишите текст задачи (получателей: {len(selected)}):")
+    return WRITING_USER_TASK
+
+# Пишем задачу другим: все задачи одной вставкой, уведомления через очередь
+@timed_handler
+async def write_user_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    task_text = update.message.text
+    sender_id = update.message.chat_id
+    receiver_ids = await database.known_contacts(context.user_data.pop('receiver_ids', None) or [])
 
+    if not receiver_ids:
+        await update.message.reply_text("❗ Ошибка: не выбран получатель задачи.", reply_markup=main_keyboard())
+        return ConversationHandler.END
+
+    task_ids = await database.add_task_for_receivers(sender_id, receiver_ids, task_text, status="pending")
+
+    await update.message.reply_text(
+        f"✅ Задача отправлена ({len(task_ids)})!",
+        reply_markup=main_keyboard(is_admin=(sender_id == ADMIN_CHAT_ID))
+    )
+
+    for receiver_id, task_id in zip(receiver_ids, task_ids):
+        notifier.send(
+            receiver_id,
+            f"📩 Вам поставили новую задачу:\n\n{task_text}",
+            reply_markup=accept_reject_keyboard(task_id)
+        )
+        # Сохраняем задачу в данных пользователя для дальнейшей обработки
+        # (user_data приложения доступен только на чтение, запись создаётся при обращении)
+        context.application.user_data[receiver_id]['pending_task_id'] = task_id
+    context.application.mark_data_for_update_persistence(user_ids=receiver_ids)
+
+    return ConversationHandler.END
 
 # Выбор задачи для завершения
+@timed_handler
 async def choose_task_to_complete(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    task_text = update.message.text
-    chat_id = update.message.chat_id
-    user_data_buffer[chat_id] = task_text
-    await update.message.reply_text(f"✅ Подтвердите завершение задачи:\n\n{task_text}", reply_markup=yes_no_keyboard())
+    query = update.callback_query
+    await query.answer()
+    chat_id = query.message.chat_id
+    task = await database.get_task(chat_id, int(query.data.split(":")[1]))
+    await query.edit_message_reply_markup(None)
+
+    if not task:
+        await query.message.reply_text("❗ Ошибка: задача не найдена.", reply_markup=main_keyboard(is_admin=(chat_id == ADMIN_CHAT_ID)))
+        return ConversationHandler.END
+
+    context.user_data['selected_task_id'] = task['id']
+    await query.message.reply_text(f"✅ Подтвердите завершение задачи:\n\n{task['task_text']}", reply_markup=yes_no_keyboard())
     return CONFIRM_COMPLETION
 
+# Листание страниц выбора задачи (остаёмся в том же состоянии)
+@timed_handler
+async def turn_picker_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    prefix, page = query.data.split(":")
+    action = prefix.removesuffix("_page")
+    markup = await task_picker(query.message.chat_id, action, int(page))
+    await query.edit_message_reply_markup(markup)
+    return CHOOSING_TASK_TO_COMPLETE if action == "complete" else CHOOSING_TASK_TO_DELETE
+
 # Подтверждение завершения
+@timed_handler
 async def confirm_completion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat_id
     answer = update.message.text
-    task_text = user_data_buffer.get(chat_id)
+    task_id = context.user_data.get('selected_task_id')
 
-    if not task_text:
+    if not task_id:
         await update.message.reply_text("❗ Ошибка: задача не найдена.", reply_markup=main_keyboard())
         return ConversationHandler.END
 
     if answer == "✅ Да":
-        await database.update_task_status_by_text(chat_id, task_text, "completed")
+        await database.update_task_status_by_id(chat_id, task_id, "completed")
         await update.message.reply_text("✅ Задача завершена!", reply_markup=main_keyboard(is_admin=(chat_id == ADMIN_CHAT_ID)))
     else:
         await update.message.reply_text("❌ Завершение отменено.", reply_markup=main_keyboard(is_admin=(chat_id == ADMIN_CHAT_ID)))
-    user_data_buffer.pop(chat_id, None)
+    context.user_data.pop('selected_task_id', None)
     
     return ConversationHandler.END
 
 # Выбор задачи для удаления
+@timed_handler
 async def choose_task_to_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    task_text = update.message.text
-    chat_id = update.message.chat_id
-    user_data_buffer[chat_id] = task_text
-    await update.message.reply_text(f"🗑️ Подтвердите удаление задачи:\n\n{task_text}", reply_markup=yes_no_keyboard())
+    query = update.callback_query
+    await query.answer()
+    chat_id = query.message.chat_id
+    task = await database.get_task(chat_id, int(query.data.split(":")[1]))
+    await query.edit_message_reply_markup(None)
+
+    if not task:
+        await query.message.reply_text("❗ Ошибка: задача не найдена.", reply_markup=main_keyboard(is_admin=(chat_id == ADMIN_CHAT_ID)))
+        return ConversationHandler.END
+
+    context.user_data['selected_task_id'] = task['id']
+    await query.message.reply_text(f"🗑️ Подтвердите удаление задачи:\n\n{task['task_text']}", reply_markup=yes_no_keyboard())
     return CONFIRM_DELETION
 
 # Подтверждение удаления
+@timed_handler
 async def confirm_deletion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat_id
     answer = update.message.text
-    task_text = user_data_buffer.get(chat_id)
+    task_id = context.user_data.get('selected_task_id')
 
-    if not task_text:
+    if not task_id:
         await update.message.reply_text("❗ Ошибка: задача не найдена.", reply_markup=main_keyboard())
         return ConversationHandler.END
 
     if answer == "✅ Да":
-        await database.delete_task_by_text(chat_id, task_text)
+        await database.delete_task_by_id(chat_id, task_id)
         await update.message.reply_text("🗑️ Задача удалена!", reply_markup=main_keyboard(is_admin=(chat_id == ADMIN_CHAT_ID)))
     else:
         await update.message.reply_text("❌ Удаление отменено.", reply_markup=main_keyboard(is_admin=(chat_id == ADMIN_CHAT_ID)))
-    user_data_buffer.pop(chat_id, None)
+    context.user_data.pop('selected_task_id', None)
     
     return ConversationHandler.END
 
-# Принятие или отклонение задачи (финальная версия)
+# Листание «Моих задач» и «Отправленных задач»
+@timed_handler
+async def turn_tasks_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    view, page = query.data.split(":")
+    render = my_tasks_page if view == "my" else sent_tasks_page
+    msg, markup = await render(query.message.chat_id, int(page))
+    await query.edit_message_text(msg, reply_markup=markup)
+
+# Принятие или отклонение задачи: кнопка под уведомлением несёт id задачи,
+# текстовые «✅ Принять»/«❌ Отклонить» (старые клавиатуры) берут последнюю ожидающую
+@timed_handler
 async def handle_accept_reject(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text
-    chat_id = update.message.chat_id
+    chat_id = update.effective_chat.id
+    is_admin = (chat_id == ADMIN_CHAT_ID)
+    query = update.callback_query
 
-    # 1. Сначала пробуем взять задачу из памяти бота
-    pending_task = context.application.user_data.get(chat_id, {}).get('pending_task_text')
+    if query:
+        await query.answer()
+        action, task_id = query.data.split(":")
+        task_id = int(task_id)
+        await query.edit_message_reply_markup(None)
+    else:
+        action = "accept" if update.message.text == "✅ Принять" else "reject"
 
-    if not pending_task:
-        # 2. Если в памяти нет – ищем последнюю незавершённую задачу в базе
-        tasks = await database.get_tasks_for_user(chat_id)
-        pending_tasks = [task for task in tasks if task['status'] == 'pending']
+        # 1. Сначала пробуем взять задачу из памяти бота
+        task_id = context.application.user_data.get(chat_id, {}).get('pending_task_id')
 
-        if not pending_tasks:
-            await update.message.reply_text(
-                "❗ Нет задач для принятия или отклонения.",
-                reply_markup=main_keyboard(is_admin=(chat_id == ADMIN_CHAT_ID))
-            )
-            return ConversationHandler.END
+        if not task_id:
+            # 2. Если в памяти нет – берём последнюю ожидающую задачу из базы
+            pending_task = await database.get_latest_pending_task(chat_id)
 
-        pending_task = pending_tasks[-1]['task_text']  # Берем последнюю задачу
+            if not pending_task:
+                await update.message.reply_text(
+                    "❗ Нет задач для принятия или отклонения.",
+                    reply_markup=main_keyboard(is_admin)
+                )
+                return ConversationHandler.END
 
-    # 3. Теперь у нас точно есть pending_task
-    if text == "✅ Принять":
-        await database.update_task_status_by_text(chat_id, pending_task, "accepted")
-        await update.message.reply_text(
-            "✅ Задача принята!",
-            reply_markup=main_keyboard(is_admin=(chat_id == ADMIN_CHAT_ID))
-        )
+            task_id = pending_task['id']
 
-    elif text == "❌ Отклонить":
-        await database.update_task_status_by_text(chat_id, pending_task, "rejected")
-        await update.message.reply_text(
-            "❌ Задача отклонена.",
-            reply_markup=main_keyboard(is_admin=(chat_id == ADMIN_CHAT_ID))
-        )
+    # 3. Меняем статус только у ожидающей задачи
+    new_status = "accepted" if action == "accept" else "rejected"
+    updated = await database.update_task_status_by_id(chat_id, task_id, new_status, old_status="pending")
 
+    if not updated:
+        reply = "❗ Задача уже обработана или не найдена."
+    elif action == "accept":
+        reply = "✅ Задача принята!"
     else:
-        await update.message.reply_text(
-            "❓ Неверная команда.",
-            reply_markup=main_keyboard(is_admin=(chat_id == ADMIN_CHAT_ID))
-        )
+        reply = "❌ Задача отклонена."
+    await update.effective_message.reply_text(reply, reply_markup=main_keyboard(is_admin))
 
-    # 4. Очищаем user_data после обработки
-    if chat_id in context.application.user_data:
-        context.application.user_data.pop(chat_id)
+    # 4. Очищаем сохранённую задачу после обработки
+    context.application.user_data.get(chat_id, {}).pop('pending_task_id', None)
 
     return ConversationHandler.END
-import speech_recognition as sr
-from pydub import AudioSegment
 
-# Обработка голосового сообщения
+# Обработка голосового сообщения: скачиваем и ставим в очередь распознавания
+@timed_handler
 async def voice_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat_id
     is_admin = (chat_id == ADMIN_CHAT_ID)
 
-    # Скачиваем голосовое сообщение
+    if transcription_queue.full():
+        await update.message.reply_text("⏳ Очередь распознавания заполнена, попробуйте позже.", reply_markup=main_keyboard(is_admin))
+        return
+
+    # Скачиваем голосовое сообщение в память
     voice = update.message.voice
     file = await context.bot.get_file(voice.file_id)
-    ogg_path = f"/tmp/{chat_id}.ogg"
-    wav_path = f"/tmp/{chat_id}.wav"
-
-    await file.download_to_drive(ogg_path)
-
-    # Конвертируем OGG -> WAV
-    AudioSegment.from_ogg(ogg_path).export(wav_path, format="wav")
-
-    # Распознаем речь
-    recognizer = sr.Recognizer()
-    with sr.AudioFile(wav_path) as source:
-        audio = recognizer.record(source)
+    ogg_bytes = bytes(await file.download_as_bytearray())
+
+    # Результат распознавания приходит отдельным сообщением
+    async def on_transcribed(text, error):
+        if error is None:
+            await database.add_task(chat_id, chat_id, text, status="accepted")
+            notifier.send(chat_id, f"✅ Задача добавлена из голосового:\n\n{text}", reply_markup=main_keyboard(is_admin))
+        elif isinstance(error, UnrecognizedSpeech):
+            notifier.send(chat_id, "❗ Не удалось распознать голосовое сообщение.", reply_markup=main_keyboard(is_admin))
+        else:
+            logging.error(f"Ошибка распознавания: {error}")
+            notifier.send(chat_id, "❗ Ошибка обработки голосового.", reply_markup=main_keyboard(is_admin))
 
     try:
-        text = recognizer.recognize_google(audio, language="ru-RU")  # Распознаём текст на русском
-        await database.add_task(chat_id, chat_id, text, status="accepted")
-        await update.message.reply_text(f"✅ Задача добавлена из голосового:\n\n{text}", reply_markup=main_keyboard(is_admin))
-    except sr.UnknownValueError:
-        await update.message.reply_text("❗ Не удалось распознать голосовое сообщение.", reply_markup=main_keyboard(is_admin))
-    except Exception as e:
-        logging.error(f"Ошибка распознавания: {e}")
-        await update.message.reply_text("❗ Ошибка обработки голосового.", reply_markup=main_keyboard(is_admin))
+        position = transcription_queue.submit(transcribe, (speech_backend, ogg_bytes), on_transcribed)
+    except asyncio.QueueFull:
+        await update.message.reply_text("⏳ Очередь распознавания заполнена, попробуйте позже.", reply_markup=main_keyboard(is_admin))
+        return
 
+    if position:
+        await update.message.reply_text(f"⏳ Голосовое в очереди на распознавание, позиция {position}.")
 
-if __name__ == "__main__":
-    app = ApplicationBuilder().token(TOKEN).build()
-
-    # Основной обработчик состояний задач
-    conv_handler = ConversationHandler(
-        entry_points=[
-            MessageHandler(filters.TEXT & ~filters.COMMAND, main_menu_handler),
-            MessageHandler(filters.CONTACT, contact_handler),
-        ],
-        states={
-            WRITING_SELF_TASK: [MessageHandler(filters.TEXT & ~filters.COMMAND, write_self_task)],
-            CHOOSING_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_user)],
-            WRITING_USER_TASK: [MessageHandler(filters.TEXT & ~filters.COMMAND, write_user_task)],
-            CHOOSING_TASK_TO_COMPLETE: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_task_to_complete)],
-            CONFIRM_COMPLETION: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_completion)],
-            CHOOSING_TASK_TO_DELETE: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_task_to_delete)],
-            CONFIRM_DELETION: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_deletion)],
-        },
-        fallbacks=[
-            MessageHandler(filters.TEXT & ~filters.COMMAND, main_menu_handler)
-        ],
+
+# Прогрев: соединения, миграции схемы, кэши, расписание напоминаний
+async def warm_up(application):
+    await weather_service.start()
+    await asyncio.to_thread(speech_backend.load)
+    await transcription_queue.start()
+    await database.open_db()
+    await database.init_db()
+    users = await database.warm_up()
+    logging.info(f"Кэш пользователей загружен: {users}")
+    await reminder_scheduler.start(application.job_queue)
+
+# Запуск приложения: прогрев с ограничением по времени
+async def post_init(application):
+    started = time.perf_counter()
+    await notifier.start(application.bot)
+    await metrics.start_server()
+    await asyncio.wait_for(warm_up(application), STARTUP_TIMEOUT)
+    logging.info(f"Холодный старт занял {time.perf_counter() - started:.3f} с")
+
+# Апдейты больше не принимаются, но бот ещё работает: дораспознаём голосовые
+# и отправляем накопленные сообщения (в post_shutdown бот уже остановлен)
+async def post_stop(application):
+    await transcription_queue.close()
+    await notifier.close()
+
+# Остановка приложения: закрываем соединения с базой и HTTP-сессию
+async def post_shutdown(application):
+    await metrics.stop_server()
+    await weather_service.close()
+    await database.close_db()
+
+
+# Сборка приложения со всеми обработчиками. request — транспорт для Bot API
+# (нагрузочный тест подставляет свой, без сети), concurrency — сколько апдейтов
+# разных чатов обрабатывается одновременно (внутри чата порядок сохраняется)
+def build_application(token=TOKEN, request=None, concurrency=UPDATE_CONCURRENCY):
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .concurrent_updates(ChatOrderedUpdateProcessor(concurrency))
+        .persistence(SQLitePersistence(update_interval=float(os.getenv("PERSISTENCE_INTERVAL", "5"))))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
     )
+    if request is not None:
+        builder = builder.request(request)
+    app = builder.build()
+
+    # Основной обработчик состояний задач. Состояния ведутся по чату (per_message=False),
+    # кнопки в состояниях так и задуманы — предупреждение PTB об этом не нужно
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="If 'per_message=False'", category=PTBUserWarning)
+        conv_handler = ConversationHandler(
+            entry_points=[
+                MessageHandler(filters.TEXT & ~filters.COMMAND, main_menu_handler),
+                MessageHandler(filters.CONTACT, contact_handler),
+            ],
+            states={
+                WRITING_SELF_TASK: [MessageHandler(filters.TEXT & ~filters.COMMAND, write_self_task)],
+                CHOOSING_USER: [
+                    CallbackQueryHandler(toggle_recipient, pattern=r"^pick:-?\d+$"),
+                    CallbackQueryHandler(turn_recipient_page, pattern=r"^pick_page:\d+$"),
+                    CallbackQueryHandler(choose_users_done, pattern=r"^pick_done$"),
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, search_recipients),
+                ],
+                WRITING_USER_TASK: [MessageHandler(filters.TEXT & ~filters.COMMAND, write_user_task)],
+                CHOOSING_TASK_TO_COMPLETE: [
+                    CallbackQueryHandler(choose_task_to_complete, pattern=r"^complete:\d+$"),
+                    CallbackQueryHandler(turn_picker_page, pattern=r"^complete_page:\d+$"),
+                ],
+                CONFIRM_COMPLETION: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_completion)],
+                CHOOSING_TASK_TO_DELETE: [
+                    CallbackQueryHandler(choose_task_to_delete, pattern=r"^delete:\d+$"),
+                    CallbackQueryHandler(turn_picker_page, pattern=r"^delete_page:\d+$"),
+                ],
+                CONFIRM_DELETION: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_deletion)],
+                WRITING_BROADCAST: [MessageHandler(filters.TEXT & ~filters.COMMAND, write_broadcast)],
+                CONFIRM_BROADCAST: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_broadcast)],
+                WRITING_REMINDER_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, write_reminder_time)],
+            },
+            fallbacks=[
+                MessageHandler(filters.TEXT & ~filters.COMMAND, main_menu_handler)
+            ],
+            name="tasks",
+            persistent=True,
+        )
 
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CallbackQueryHandler(handle_accept_reject, pattern=r"^(accept|reject):\d+$"))
+    app.add_handler(CallbackQueryHandler(turn_tasks_page, pattern=r"^(my|sent):\d+$"))
     app.add_handler(MessageHandler(filters.Regex("^(✅ Принять|❌ Отклонить)$"), handle_accept_reject))
-    app.add_handler(MessageHandler(filters.VOICE, voice_handler))  
+    app.add_handler(MessageHandler(filters.VOICE, voice_handler))
     app.add_handler(conv_handler)
+    return app
 
 
-    
+if __name__ == "__main__":
+    app = build_application()
 
     # Стартуем через Webhook
     app.run_webhook(
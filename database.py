@@ -1,124 +1,678 @@
+import asyncio
+import bisect
+import logging
+import os
+from contextlib import asynccontextmanager
+
 import aiosqlite
 
+import metrics
+
+DB_PATH = os.getenv("DB_PATH", "tasks.db")
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+# Окно группировки записей задач в одну транзакцию (мс); 0 — каждая операция коммитится сразу
+WRITE_BATCH_MS = float(os.getenv("DB_WRITE_BATCH_MS", "0"))
+# Надёжность коммита: NORMAL в WAL не ждёт fsync на каждый коммит, FULL — ждёт
+SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL").upper()
+if SYNCHRONOUS not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+    raise ValueError(f"Неизвестное значение DB_SYNCHRONOUS: {SYNCHRONOUS}")
+
+# Настройки соединений: WAL позволяет читать параллельно с записью
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    f"PRAGMA synchronous={SYNCHRONOUS}",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+
+# Долгоживущие соединения: один писатель и пул читателей
+_writer = None
+_write_lock = None
+_readers = None
+_reader_conns = []
+
+# Открытая пакетная транзакция: future её коммита, число операций и задача отложенного коммита
+_batch = None
+_batch_size = 0
+_batch_task = None
+
+WRITE_BATCH_SIZE = metrics.Histogram(
+    "db_write_batch_size", "Операций в одной пакетной транзакции", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+
+# Кэш chat_id -> username, общий для всех выборок
+_username_cache = {}
+
+# Справочник контактов для поиска по началу имени: отсортированный список
+# (имя в нижнем регистре, chat_id, имя); None — ещё не загружен
+_contacts = None
+_contact_entries = {}   # chat_id -> его запись в _contacts
+
+async def _connect(path, readonly=False):
+    db = await aiosqlite.connect(path)
+    for pragma in PRAGMAS:
+        await db.execute(pragma)
+    if readonly:
+        await db.execute("PRAGMA query_only=ON")
+    return db
+
+# Открытие соединений (один раз при старте приложения)
+async def open_db(path=DB_PATH, pool_size=READ_POOL_SIZE):
+    global _writer, _write_lock, _readers
+    if _writer is not None:
+        return
+    _writer = await _connect(path)
+    _write_lock = asyncio.Lock()
+    _readers = asyncio.Queue()
+    for _ in range(pool_size):
+        conn = await _connect(path, readonly=True)
+        _reader_conns.append(conn)
+        _readers.put_nowait(conn)
+
+# Закрытие соединений (при остановке приложения)
+async def close_db():
+    global _writer, _write_lock, _readers, _contacts, _batch_task
+    if _writer is None:
+        return
+    async with _write_lock:
+        await _commit_batch()
+    if _batch_task is not None:
+        _batch_task.cancel()
+        _batch_task = None
+    for conn in _reader_conns:
+        await conn.close()
+    _reader_conns.clear()
+    await _writer.close()
+    _writer = _write_lock = _readers = _contacts = None
+    _username_cache.clear()
+    _contact_entries.clear()
+
+# Замер времени запроса (метка query — имя функции); без метрик декоратор ничего не меняет
+def _timed(func):
+    return metrics.timed(metrics.DB_SECONDS, query=func.__name__)(func)
+
+def _ensure_open():
+    if _writer is None:
+        raise RuntimeError("База данных не открыта: сначала вызовите open_db()")
+
+# Соединение для чтения из пула
+@asynccontextmanager
+async def _read():
+    _ensure_open()
+    db = await _readers.get()
+    try:
+        yield db
+    finally:
+        _readers.put_nowait(db)
+
+# Соединение для записи: одна транзакция под общей блокировкой
+# (открытая пакетная транзакция сначала коммитится, чтобы не смешивать их)
+@asynccontextmanager
+async def _write():
+    _ensure_open()
+    async with _write_lock:
+        await _commit_batch()
+        try:
+            yield _writer
+        except BaseException:
+            await _writer.rollback()
+            raise
+        await _writer.commit()
+
+def _finish(future, error=None):
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+# Коммит открытой пакетной транзакции (вызывается под _write_lock)
+async def _commit_batch():
+    global _batch, _batch_size
+    batch, size = _batch, _batch_size
+    if batch is None:
+        return
+    _batch, _batch_size = None, 0
+    WRITE_BATCH_SIZE.observe(size)
+    try:
+        await _writer.commit()
+    except Exception as e:
+        await _writer.rollback()
+        _finish(batch, e)
+    else:
+        _finish(batch)
+
+async def _commit_later(batch):
+    await asyncio.sleep(WRITE_BATCH_MS / 1000)
+    async with _write_lock:
+        if _batch is batch:
+            await _commit_batch()
+
+# Запись с группировкой (write-behind): операции, пришедшие за WRITE_BATCH_MS,
+# выполняются в одной транзакции, каждая в своём SAVEPOINT — ошибка откатывает
+# только её. Выход из блока ждёт коммита всей пачки, так что вызывающий
+# по-прежнему получает подтверждение записи. При WRITE_BATCH_MS = 0 — как _write()
+@asynccontextmanager
+async def _write_batched():
+    global _batch, _batch_size, _batch_task
+    if WRITE_BATCH_MS <= 0:
+        async with _write() as db:
+            yield db
+        return
+    _ensure_open()
+    async with _write_lock:
+        if _batch is None:
+            await _writer.execute('BEGIN')
+            _batch = asyncio.get_running_loop().create_future()
+            _batch_task = asyncio.create_task(_commit_later(_batch))
+        batch = _batch
+        await _writer.execute('SAVEPOINT batched_write')
+        try:
+            yield _writer
+        except BaseException:
+            try:
+                await _writer.execute('ROLLBACK TO batched_write')
+                await _writer.execute('RELEASE batched_write')
+            except Exception as e:
+                # Транзакция потеряна целиком: пачка завершается ошибкой
+                await _writer.rollback()
+                _batch, _batch_size = None, 0
+                _finish(batch, e)
+            raise
+        await _writer.execute('RELEASE batched_write')
+        _batch_size += 1
+    # shield: отмена одного ожидающего не отменяет коммит для остальных
+    await asyncio.shield(batch)
+
+# Статусы задач: «открытые» — всё, кроме завершённых, «активные» — можно завершить.
+# В запросах списки подставляются литералами, иначе SQLite не использует частичные индексы
+OPEN_STATUSES = ('pending', 'accepted', 'rejected')
+ACTIVE_STATUSES = ('pending', 'accepted')
+
+def _status_list(statuses):
+    return ", ".join(f"'{status}'" for status in statuses)
+
+# Миграции схемы: миграция с номером N (индекс в списке + 1) переводит базу
+# на версию N, текущая версия хранится в PRAGMA user_version.
+# Существующие миграции не меняются — только добавляются новые в конец.
+MIGRATIONS = [
+    # 1. Базовые таблицы
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER UNIQUE,
+            username TEXT,
+            phone_number TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_id INTEGER,
+            receiver_id INTEGER,
+            task_text TEXT,
+            status TEXT DEFAULT 'pending'
+        )
+        ''',
+    ),
+    # 2. Индексы под горячие выборки по получателю, статусу, тексту и отправителю
+    (
+        'CREATE INDEX IF NOT EXISTS idx_tasks_receiver_status ON tasks (receiver_id, status)',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_receiver_text ON tasks (receiver_id, task_text)',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_sender ON tasks (sender_id)',
+    ),
+    # 3. Задачи меняются по id, индекс по тексту больше не нужен
+    (
+        'DROP INDEX IF EXISTS idx_tasks_receiver_text',
+    ),
+    # 4. Состояние бота (user_data, chat_data, bot_data, диалоги) для SQLitePersistence;
+    # token меняется при каждой записи и показывает, чья версия лежит в базе
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS bot_state (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            token TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+        ''',
+    ),
+    # 5. Частичные индексы по открытым и активным задачам: страницы идут по id без сортировки,
+    # а завершённая история в индексы не попадает
+    (
+        f'CREATE INDEX IF NOT EXISTS idx_tasks_receiver_open ON tasks (receiver_id) WHERE status IN ({_status_list(OPEN_STATUSES)})',
+        f'CREATE INDEX IF NOT EXISTS idx_tasks_receiver_active ON tasks (receiver_id) WHERE status IN ({_status_list(ACTIVE_STATUSES)})',
+    ),
+    # 6. Счётчики задач по пользователю, роли (sent/received) и статусу,
+    # заполняются по текущим задачам и дальше ведутся триггерами
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS task_stats (
+            user_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, role, status)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT INTO task_stats (user_id, role, status, count)
+        SELECT sender_id, 'sent', status, COUNT(*) FROM tasks GROUP BY sender_id, status
+        ''',
+        '''
+        INSERT INTO task_stats (user_id, role, status, count)
+        SELECT receiver_id, 'received', status, COUNT(*) FROM tasks GROUP BY receiver_id, status
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_task_stats_insert AFTER INSERT ON tasks
+        BEGIN
+            INSERT INTO task_stats (user_id, role, status, count) VALUES (NEW.sender_id, 'sent', NEW.status, 1)
+                ON CONFLICT (user_id, role, status) DO UPDATE SET count = count + 1;
+            INSERT INTO task_stats (user_id, role, status, count) VALUES (NEW.receiver_id, 'received', NEW.status, 1)
+                ON CONFLICT (user_id, role, status) DO UPDATE SET count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_task_stats_update AFTER UPDATE OF sender_id, receiver_id, status ON tasks
+        WHEN OLD.status IS NOT NEW.status OR OLD.sender_id IS NOT NEW.sender_id OR OLD.receiver_id IS NOT NEW.receiver_id
+        BEGIN
+            UPDATE task_stats SET count = count - 1 WHERE user_id = OLD.sender_id AND role = 'sent' AND status = OLD.status;
+            UPDATE task_stats SET count = count - 1 WHERE user_id = OLD.receiver_id AND role = 'received' AND status = OLD.status;
+            INSERT INTO task_stats (user_id, role, status, count) VALUES (NEW.sender_id, 'sent', NEW.status, 1)
+                ON CONFLICT (user_id, role, status) DO UPDATE SET count = count + 1;
+            INSERT INTO task_stats (user_id, role, status, count) VALUES (NEW.receiver_id, 'received', NEW.status, 1)
+                ON CONFLICT (user_id, role, status) DO UPDATE SET count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_task_stats_delete AFTER DELETE ON tasks
+        BEGIN
+            UPDATE task_stats SET count = count - 1 WHERE user_id = OLD.sender_id AND role = 'sent' AND status = OLD.status;
+            UPDATE task_stats SET count = count - 1 WHERE user_id = OLD.receiver_id AND role = 'received' AND status = OLD.status;
+        END
+        ''',
+    ),
+    # 7. Подписки на ежедневный чек-лист: время напоминания «ЧЧ:ММ» на пользователя
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS reminders (
+            chat_id INTEGER PRIMARY KEY,
+            remind_at TEXT NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_reminders_remind_at ON reminders (remind_at)',
+    ),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Текущая версия схемы
+async def get_schema_version():
+    async with _read() as db:
+        cursor = await db.execute('PRAGMA user_version')
+        row = await cursor.fetchone()
+        return row[0]
+
+# Применение миграций до нужной версии, каждая — в своей транзакции.
+# BEGIN IMMEDIATE сразу берёт блокировку записи, а версия перечитывается внутри
+# транзакции: если шаг уже применил параллельно стартовавший процесс, он пропускается
+async def migrate(target=SCHEMA_VERSION):
+    if not 0 <= target <= SCHEMA_VERSION:
+        raise ValueError(f"Неизвестная версия схемы {target}, допустимо от 0 до {SCHEMA_VERSION}")
+    async with _write() as db:
+        version = await _user_version(db)
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"Версия базы {version} новее, чем поддерживает код ({SCHEMA_VERSION})")
+        for number in range(version + 1, target + 1):
+            await db.execute('BEGIN IMMEDIATE')
+            if await _user_version(db) >= number:
+                await db.rollback()
+                continue
+            for statement in MIGRATIONS[number - 1]:
+                await db.execute(statement)
+            await db.execute(f'PRAGMA user_version = {number}')
+            await db.commit()
+            logging.info(f"База данных обновлена до версии {number}")
+        return max(version, target)
+
+async def _user_version(db):
+    cursor = await db.execute('PRAGMA user_version')
+    (version,) = await cursor.fetchone()
+    return version
+
 # Инициализация базы
 async def init_db():
-    async with aiosqlite.connect('tasks.db') as db:
-        # Таблица пользователей
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER UNIQUE,
-                username TEXT,
-                phone_number TEXT
-            )
-        ''')
-        # Таблица задач
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sender_id INTEGER,
-                receiver_id INTEGER,
-                task_text TEXT,
-                status TEXT DEFAULT 'pending'
-            )
-        ''')
-        await db.commit()
-
-# Добавление пользователя
+    await migrate()
+
+# Прогрев: проверка схемы и загрузка кэша имён и справочника контактов
+async def warm_up():
+    version = await get_schema_version()
+    if version != SCHEMA_VERSION:
+        raise RuntimeError(f"Версия схемы {version}, ожидается {SCHEMA_VERSION}")
+    return await _load_contacts()
+
+async def _load_contacts():
+    global _contacts
+    async with _read() as db:
+        cursor = await db.execute('SELECT chat_id, username FROM users WHERE username IS NOT NULL')
+        rows = await cursor.fetchall()
+    _username_cache.update(rows)
+    _contact_entries.clear()
+    _contact_entries.update((chat_id, (username.lower(), chat_id, username)) for chat_id, username in rows)
+    _contacts = sorted(_contact_entries.values())
+    return len(rows)
+
+# Добавление или замена контакта в справочнике
+def _index_contact(chat_id, username):
+    old = _contact_entries.pop(chat_id, None)
+    if old is not None:
+        del _contacts[bisect.bisect_left(_contacts, old)]
+    entry = (username.lower(), chat_id, username)
+    bisect.insort(_contacts, entry)
+    _contact_entries[chat_id] = entry
+
+# Добавление или обновление пользователя (телефон не затирается пустым значением)
+@_timed
 async def add_user(chat_id, username, phone_number=None):
-    async with aiosqlite.connect('tasks.db') as db:
+    async with _write() as db:
         await db.execute('''
-            INSERT OR IGNORE INTO users (chat_id, username, phone_number)
+            INSERT INTO users (chat_id, username, phone_number)
             VALUES (?, ?, ?)
+            ON CONFLICT (chat_id) DO UPDATE SET
+                username = excluded.username,
+                phone_number = COALESCE(excluded.phone_number, users.phone_number)
         ''', (chat_id, username, phone_number))
-        await db.commit()
+    _username_cache[chat_id] = username
+    if _contacts is not None and username is not None:
+        _index_contact(chat_id, username)
+
+# Поиск контактов по началу имени без учёта регистра (limit/offset — одна страница).
+# Двоичный поиск по справочнику в памяти: стоимость не зависит от числа пользователей
+@_timed
+async def search_contacts(prefix="", limit=None, offset=0, exclude=None):
+    if _contacts is None:
+        await _load_contacts()
+    prefix = prefix.lower()
+    found = []
+    for i in range(bisect.bisect_left(_contacts, (prefix,)), len(_contacts)):
+        key, chat_id, username = _contacts[i]
+        if not key.startswith(prefix) or (limit is not None and len(found) >= limit):
+            break
+        if chat_id == exclude:
+            continue
+        if offset:
+            offset -= 1
+            continue
+        found.append({'chat_id': chat_id, 'username': username})
+    return found
+
+# Только те chat_id, что есть в справочнике контактов (порядок сохраняется)
+@_timed
+async def known_contacts(chat_ids):
+    if _contacts is None:
+        await _load_contacts()
+    return [chat_id for chat_id in chat_ids if chat_id in _contact_entries]
 
 # Получение всех пользователей
+@_timed
 async def get_all_contacts():
-    async with aiosqlite.connect('tasks.db') as db:
+    async with _read() as db:
         cursor = await db.execute('SELECT chat_id, username, phone_number FROM users')
         rows = await cursor.fetchall()
         return [{'chat_id': row[0], 'username': row[1], 'phone_number': row[2]} for row in rows]
 
-# Добавление задачи
+# Добавление задачи, возвращает её id
+@_timed
 async def add_task(sender_id, receiver_id, task_text, status="pending"):
-    async with aiosqlite.connect('tasks.db') as db:
-        await db.execute('''
+    async with _write_batched() as db:
+        cursor = await db.execute('''
             INSERT INTO tasks (sender_id, receiver_id, task_text, status)
             VALUES (?, ?, ?, ?)
         ''', (sender_id, receiver_id, task_text, status))
-        await db.commit()
+        return cursor.lastrowid
+
+# Добавление пачки задач одной транзакцией: [(sender_id, receiver_id, task_text, status)]
+@_timed
+async def add_tasks(tasks):
+    async with _write_batched() as db:
+        await db.executemany('''
+            INSERT INTO tasks (sender_id, receiver_id, task_text, status)
+            VALUES (?, ?, ?, ?)
+        ''', tasks)
+
+# Одна задача многим получателям одной транзакцией, возвращает id задач
+# в порядке получателей. Вставки идут подряд под блокировкой записи,
+# поэтому id последовательны и восстанавливаются по last_insert_rowid()
+@_timed
+async def add_task_for_receivers(sender_id, receiver_ids, task_text, status="pending"):
+    if not receiver_ids:
+        return []
+    async with _write_batched() as db:
+        await db.executemany('''
+            INSERT INTO tasks (sender_id, receiver_id, task_text, status)
+            VALUES (?, ?, ?, ?)
+        ''', [(sender_id, receiver_id, task_text, status) for receiver_id in receiver_ids])
+        cursor = await db.execute('SELECT last_insert_rowid()')
+        last_id, = await cursor.fetchone()
+    return list(range(last_id - len(receiver_ids) + 1, last_id + 1))
 
 # Обновление статуса задачи после принятия/отклонения
+@_timed
 async def update_task_status(receiver_id, new_status):
-    async with aiosqlite.connect('tasks.db') as db:
+    async with _write_batched() as db:
         await db.execute('''
             UPDATE tasks
             SET status = ?
             WHERE receiver_id = ? AND status = 'pending'
         ''', (new_status, receiver_id))
-        await db.commit()
 
-# Обновление статуса по тексту задачи (для завершения)
-async def update_task_status_by_text(user_id, task_text, new_status):
-    async with aiosqlite.connect('tasks.db') as db:
-        await db.execute('''
+# Обновление статуса задачи по id (только задачи получателя user_id;
+# old_status ограничивает переход, например только из 'pending')
+@_timed
+async def update_task_status_by_id(user_id, task_id, new_status, old_status=None):
+    async with _write_batched() as db:
+        cursor = await db.execute('''
             UPDATE tasks
             SET status = ?
-            WHERE receiver_id = ? AND task_text = ?
-        ''', (new_status, user_id, task_text))
-        await db.commit()
+            WHERE id = ? AND receiver_id = ? AND (? IS NULL OR status = ?)
+        ''', (new_status, task_id, user_id, old_status, old_status))
+        return cursor.rowcount > 0
 
-# Удаление задачи по тексту
-async def delete_task_by_text(user_id, task_text):
-    async with aiosqlite.connect('tasks.db') as db:
-        await db.execute('''
+# Удаление задачи по id
+@_timed
+async def delete_task_by_id(user_id, task_id):
+    async with _write_batched() as db:
+        cursor = await db.execute('''
             DELETE FROM tasks
-            WHERE receiver_id = ? AND task_text = ?
-        ''', (user_id, task_text))
-        await db.commit()
+            WHERE id = ? AND receiver_id = ?
+        ''', (task_id, user_id))
+        return cursor.rowcount > 0
 
-# Получение задач, которые назначены пользователю
-async def get_tasks_for_user(user_id):
-    async with aiosqlite.connect('tasks.db') as db:
+# Получение задачи получателя по id
+@_timed
+async def get_task(user_id, task_id):
+    async with _read() as db:
         cursor = await db.execute('''
-            SELECT task_text, status
+            SELECT id, sender_id, task_text, status
             FROM tasks
-            WHERE receiver_id = ?
-        ''', (user_id,))
+            WHERE id = ? AND receiver_id = ?
+        ''', (task_id, user_id))
+        row = await cursor.fetchone()
+    if not row:
+        return None
+    return {'id': row[0], 'sender_id': row[1], 'task_text': row[2], 'status': row[3]}
+
+# Выборка страницы задач получателя с дополнительным условием по статусу
+async def _get_tasks(user_id, status_filter, limit, offset):
+    async with _read() as db:
+        cursor = await db.execute(f'''
+            SELECT id, task_text, status
+            FROM tasks
+            WHERE receiver_id = ?{status_filter}
+            ORDER BY id
+            LIMIT ? OFFSET ?
+        ''', (user_id, -1 if limit is None else limit, offset))
         rows = await cursor.fetchall()
-        return [{'task_text': row[0], 'status': row[1]} for row in rows]
+        return [{'id': row[0], 'task_text': row[1], 'status': row[2]} for row in rows]
+
+# Получение задач, которые назначены пользователю (limit/offset — одна страница)
+@_timed
+async def get_tasks_for_user(user_id, limit=None, offset=0):
+    return await _get_tasks(user_id, '', limit, offset)
+
+# Открытые задачи пользователя (всё, кроме завершённых)
+@_timed
+async def get_open_tasks(user_id, limit=None, offset=0):
+    return await _get_tasks(user_id, f' AND status IN ({_status_list(OPEN_STATUSES)})', limit, offset)
+
+# Активные задачи пользователя (ожидают ответа или приняты)
+@_timed
+async def get_active_tasks(user_id, limit=None, offset=0):
+    return await _get_tasks(user_id, f' AND status IN ({_status_list(ACTIVE_STATUSES)})', limit, offset)
+
+# Последняя задача пользователя, ожидающая принятия
+@_timed
+async def get_latest_pending_task(user_id):
+    async with _read() as db:
+        cursor = await db.execute('''
+            SELECT id, task_text, status
+            FROM tasks
+            WHERE receiver_id = ? AND status = 'pending'
+            ORDER BY id DESC
+            LIMIT 1
+        ''', (user_id,))
+        row = await cursor.fetchone()
+    if not row:
+        return None
+    return {'id': row[0], 'task_text': row[1], 'status': row[2]}
 
 # Получение задач, которые пользователь поставил другим
-async def get_assigned_tasks(sender_id):
-    async with aiosqlite.connect('tasks.db') as db:
+@_timed
+async def get_assigned_tasks(sender_id, limit=None, offset=0):
+    async with _read() as db:
         cursor = await db.execute('''
-            SELECT task_text, status, receiver_id
+            SELECT tasks.task_text, tasks.status, tasks.receiver_id, users.username
             FROM tasks
-            WHERE sender_id = ?
-        ''', (sender_id,))
+            LEFT JOIN users ON users.chat_id = tasks.receiver_id
+            WHERE tasks.sender_id = ?
+            ORDER BY tasks.id
+            LIMIT ? OFFSET ?
+        ''', (sender_id, -1 if limit is None else limit, offset))
         rows = await cursor.fetchall()
 
-        assigned_tasks = []
-        for task in rows:
-            receiver_username = await get_username_by_id(task[2])
-            assigned_tasks.append({
-                'task_text': task[0],
-                'status': task[1],
-                'receiver_username': receiver_username
-            })
-        return assigned_tasks
-
-# Получение username по chat_id
+    assigned_tasks = []
+    for task_text, status, receiver_id, username in rows:
+        if username is not None:
+            _username_cache[receiver_id] = username
+        assigned_tasks.append({
+            'task_text': task_text,
+            'status': status,
+            'receiver_username': username or "Неизвестный"
+        })
+    return assigned_tasks
+
+# Получение username по chat_id (через кэш)
+@_timed
 async def get_username_by_id(chat_id):
-    async with aiosqlite.connect('tasks.db') as db:
+    username = _username_cache.get(chat_id)
+    if username is not None:
+        return username
+    async with _read() as db:
         cursor = await db.execute('SELECT username FROM users WHERE chat_id = ?', (chat_id,))
         row = await cursor.fetchone()
-        return row[0] if row else "Неизвестный"
+    if not row or row[0] is None:
+        return "Неизвестный"
+    _username_cache[chat_id] = row[0]
+    return row[0]
+
+# Статистика пользователя по счётчикам task_stats:
+# {'sent': {статус: количество}, 'received': {статус: количество}}
+@_timed
+async def get_user_stats(user_id):
+    async with _read() as db:
+        cursor = await db.execute('SELECT role, status, count FROM task_stats WHERE user_id = ?', (user_id,))
+        rows = await cursor.fetchall()
+    stats = {'sent': {}, 'received': {}}
+    for role, status, count in rows:
+        if count:
+            stats[role][status] = count
+    return stats
 
 # Получение количества всех задач, поставленных пользователем
+@_timed
 async def get_task_count(sender_id):
-    async with aiosqlite.connect('tasks.db') as db:
-        cursor = await db.execute('SELECT COUNT(*) FROM tasks WHERE sender_id = ?', (sender_id,))
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT COALESCE(SUM(count), 0) FROM task_stats WHERE user_id = ? AND role = 'sent'", (sender_id,)
+        )
         row = await cursor.fetchone()
         return row[0] if row else 0
+
+# Подписка на напоминание (или смена времени)
+@_timed
+async def set_reminder(chat_id, remind_at):
+    async with _write() as db:
+        await db.execute('''
+            INSERT INTO reminders (chat_id, remind_at) VALUES (?, ?)
+            ON CONFLICT (chat_id) DO UPDATE SET remind_at = excluded.remind_at
+        ''', (chat_id, remind_at))
+
+# Отписка от напоминания
+@_timed
+async def delete_reminder(chat_id):
+    async with _write() as db:
+        await db.execute('DELETE FROM reminders WHERE chat_id = ?', (chat_id,))
+
+# Время напоминания пользователя или None
+@_timed
+async def get_reminder(chat_id):
+    async with _read() as db:
+        cursor = await db.execute('SELECT remind_at FROM reminders WHERE chat_id = ?', (chat_id,))
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
+# Все времена, на которые есть подписчики
+@_timed
+async def get_reminder_slots():
+    async with _read() as db:
+        cursor = await db.execute('SELECT DISTINCT remind_at FROM reminders')
+        return [row[0] for row in await cursor.fetchall()]
+
+# Подписчики одного времени
+@_timed
+async def get_reminder_subscribers(remind_at):
+    async with _read() as db:
+        cursor = await db.execute('SELECT chat_id FROM reminders WHERE remind_at = ?', (remind_at,))
+        return [row[0] for row in await cursor.fetchall()]
+
+# Загрузка всех записей состояния бота одного вида: [(key, token, data)]
+@_timed
+async def load_state(kind):
+    async with _read() as db:
+        cursor = await db.execute('SELECT key, token, data FROM bot_state WHERE kind = ?', (kind,))
+        return await cursor.fetchall()
+
+# Загрузка одной записи состояния: (token, data) или None
+@_timed
+async def load_state_entry(kind, key):
+    async with _read() as db:
+        cursor = await db.execute('SELECT token, data FROM bot_state WHERE kind = ? AND key = ?', (kind, key))
+        return await cursor.fetchone()
+
+# Сохранение пачки записей состояния одной транзакцией: [(kind, key, token, data)],
+# data = None удаляет запись
+@_timed
+async def save_state(entries):
+    upserts = [entry for entry in entries if entry[3] is not None]
+    deletes = [(kind, key) for kind, key, _, data in entries if data is None]
+    async with _write() as db:
+        await db.executemany('''
+            INSERT INTO bot_state (kind, key, token, data)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (kind, key) DO UPDATE SET token = excluded.token, data = excluded.data
+        ''', upserts)
+        await db.executemany('DELETE FROM bot_state WHERE kind = ? AND key = ?', deletes)
@@ -0,0 +1,178 @@
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import time
+
+from aiohttp import web
+
+# Метрики включаются переменной METRICS_PORT (решается один раз при импорте).
+# Без неё декораторы возвращают функцию как есть, а observe/inc ничего не делают
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.getenv("METRICS_PORT")
+ENABLED = bool(METRICS_PORT)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = {}   # имя -> метрика; повторная регистрация заменяет прежнюю
+_runner = None
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# Метрика в формате Prometheus: имя, описание и значения по набору меток
+class Metric:
+    type = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        _registry[name] = self
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+        lines += self._samples()
+        return lines
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+# Текущее значение; func — функция, которая вызывается при каждом чтении метрик
+# (например, длина очереди), тогда в рабочем коде ничего делать не нужно
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name, description, labels=(), func=None):
+        super().__init__(name, description, labels)
+        self.func = func
+
+    def set(self, value, **labels):
+        if ENABLED:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        if self.func is not None:
+            return [f"{self.name} {self.func()}"]
+        return super()._samples()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # счётчики по корзинам (последняя — +Inf), сумма, количество
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+# Общие метрики: обработчики, запросы к базе и внешние API
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время обработки апдейта", ("handler",))
+DB_SECONDS = Histogram("db_query_seconds", "Время запросов к базе", ("query",))
+OUTBOUND_SECONDS = Histogram("outbound_request_seconds", "Время запросов к внешним API", ("service",))
+
+
+# Декоратор: время выполнения функции (обычной или async) в гистограмму.
+# Значение метки может быть функцией от аргументов вызова
+def timed(histogram, **labels):
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        def resolve(args, kwargs):
+            return {name: value(*args, **kwargs) if callable(value) else value for name, value in labels.items()}
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, **resolve(args, kwargs))
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, **resolve(args, kwargs))
+        return wrapper
+    return decorator
+
+
+# Все метрики в текстовом формате Prometheus
+def render():
+    lines = []
+    for metric in _registry.values():
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+async def _handle_metrics(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+# HTTP-сервер /metrics (отдельный порт, рядом с вебхуком)
+async def start_server():
+    global _runner
+    if not ENABLED or _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, METRICS_HOST, int(METRICS_PORT)).start()
+    logging.info(f"Метрики доступны на http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+async def stop_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
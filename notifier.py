@@ -0,0 +1,147 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import metrics
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+# Исходящие сообщения: очередь на каждый чат и фоновый диспетчер.
+# Диспетчер соблюдает общий лимит Telegram (global_rate сообщений в секунду)
+# и интервал между сообщениями в один чат, сохраняет порядок внутри чата,
+# при RetryAfter приостанавливает отправку и повторяет сообщение.
+class Notifier:
+    def __init__(self, global_rate=25, chat_interval=1.0, max_retries=3):
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.bot = None
+        self._chats = {}       # chat_id -> deque[(kwargs, future, попытка)]
+        self._ready = []       # куча (время готовности, порядковый номер, chat_id)
+        self._counter = itertools.count()
+        self._sending = set()
+        self._next_slot = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closed = False
+
+    async def start(self, bot):
+        self.bot = bot
+        self._closed = False
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+
+    # Остановка: даём отправить оставшееся за timeout секунд, затем прерываем
+    # отправку; всё недоставленное (и отправленное после остановки) получает None
+    async def close(self, timeout=5):
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self.pending or self._sending) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._closed = True
+        tasks = [self._task, *self._sending]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        for queue in self._chats.values():
+            for _, future, _ in queue:
+                _resolve(future, None)
+        self._chats.clear()
+        self._ready.clear()
+
+    # Сколько сообщений ждёт отправки
+    @property
+    def pending(self):
+        return sum(len(queue) for queue in self._chats.values())
+
+    # Постановка сообщения в очередь. Возвращает future с отправленным
+    # сообщением (None, если доставить не удалось); ждать его не обязательно
+    def send(self, chat_id, text, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        if self._closed:
+            future.set_result(None)
+            return future
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = deque()
+            self._schedule(chat_id, time.monotonic())
+        queue.append(({'chat_id': chat_id, 'text': text, **kwargs}, future, 0))
+        return future
+
+    # Рассылка одного текста многим чатам
+    def broadcast(self, chat_ids, text, **kwargs):
+        return [self.send(chat_id, text, **kwargs) for chat_id in chat_ids]
+
+    def _schedule(self, chat_id, ready_at):
+        heapq.heappush(self._ready, (ready_at, next(self._counter), chat_id))
+        self._wakeup.set()
+
+    async def _dispatch(self):
+        while True:
+            if not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            delay = max(self._ready[0][0], self._next_slot) - now
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            message, future, attempt = self._chats[chat_id].popleft()
+            self._next_slot = now + 1 / self.global_rate
+            task = asyncio.create_task(self._deliver(chat_id, message, future, attempt))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _deliver(self, chat_id, message, future, attempt):
+        retry_at = None
+        started = time.perf_counter()
+        try:
+            result = await self.bot.send_message(**message)
+            metrics.OUTBOUND_SECONDS.observe(time.perf_counter() - started, service="telegram")
+            _resolve(future, result)
+        except asyncio.CancelledError:
+            # Остановка во время отправки
+            _resolve(future, None)
+            raise
+        except RetryAfter as e:
+            # Флуд-контроль: пауза для всех чатов и повтор этого сообщения
+            retry_at = time.monotonic() + e.retry_after
+            self._next_slot = max(self._next_slot, retry_at)
+        except (Forbidden, BadRequest) as e:
+            logging.warning(f"Сообщение в чат {chat_id} не доставлено: {e}")
+            _resolve(future, None)
+        except NetworkError as e:
+            if attempt < self.max_retries:
+                retry_at = time.monotonic() + 2 ** attempt
+            else:
+                logging.error(f"Сообщение в чат {chat_id} не доставлено после {attempt + 1} попыток: {e}")
+                _resolve(future, None)
+        except Exception as e:
+            logging.error(f"Ошибка отправки в чат {chat_id}: {e}")
+            _resolve(future, None)
+
+        queue = self._chats[chat_id]
+        if retry_at is not None:
+            queue.appendleft((message, future, attempt + 1))
+        if queue:
+            self._schedule(chat_id, max(retry_at or 0, time.monotonic() + self.chat_interval))
+        else:
+            del self._chats[chat_id]
@@ -0,0 +1,154 @@
+import asyncio
+import itertools
+import json
+import logging
+import uuid
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import database
+
+USER, CHAT, BOT = "user", "chat", "bot"
+
+
+# Хранилище состояния бота в SQLite (таблица bot_state): user_data и состояния
+# диалогов. chat_data и bot_data бот не использует и не хранит, иначе PTB
+# перечитывал бы их на каждом апдейте. Изменения копятся в памяти и пишутся одной
+# транзакцией через flush_delay секунд после первого изменения. Перед каждым
+# обновлением данные перечитываются, если их с тех пор записал другой процесс.
+class SQLitePersistence(BasePersistence):
+    def __init__(self, update_interval=5, flush_delay=0.05):
+        super().__init__(store_data=PersistenceInput(chat_data=False, bot_data=False, callback_data=False), update_interval=update_interval)
+        self.flush_delay = flush_delay
+        self._token_prefix = uuid.uuid4().hex[:12]
+        self._token_counter = itertools.count()
+        self._tokens = {}    # (kind, key) -> token версии, которая у нас в памяти
+        self._pending = {}   # (kind, key) -> (token, json или None для удаления)
+        self._inflight = {}  # то же для пачки, которая сейчас пишется в базу
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        self._ready = False
+
+    # Данные загружаются при initialize(), до post_init, поэтому базу открываем здесь
+    async def _ensure_ready(self):
+        if not self._ready:
+            await database.open_db()
+            await database.init_db()
+            self._ready = True
+
+    async def _load(self, kind):
+        await self._ensure_ready()
+        loaded = {}
+        for key, token, data in await database.load_state(kind):
+            self._tokens[(kind, key)] = token
+            loaded[key] = json.loads(data)
+        return loaded
+
+    # Есть ли у нас своя ещё не записанная (или записываемая) версия
+    def _unsaved(self, kind, key):
+        return (kind, key) in self._pending or (kind, key) in self._inflight
+
+    # Свежие данные из базы, если их записал кто-то другой, иначе None.
+    # Пока своя версия не закоммичена, в базе лежит более старая — её не берём
+    async def _refresh(self, kind, key):
+        if self._unsaved(kind, key):
+            return None
+        row = await database.load_state_entry(kind, key)
+        if row is None or self._unsaved(kind, key) or row[0] == self._tokens.get((kind, key)):
+            return None
+        self._tokens[(kind, key)] = row[0]
+        return json.loads(row[1])
+
+    def _stage(self, kind, key, data):
+        token = f"{self._token_prefix}:{next(self._token_counter)}"
+        self._tokens[(kind, key)] = token
+        self._pending[(kind, key)] = (token, None if data is None else json.dumps(data, ensure_ascii=False))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        self._flush_task = None
+        try:
+            await self._write_pending()
+        except Exception as e:
+            logging.error(f"Не удалось сохранить состояние бота: {e}")
+
+    async def _write_pending(self):
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            self._inflight = pending
+            try:
+                await database.save_state([(kind, key, token, data) for (kind, key), (token, data) in pending.items()])
+            except Exception:
+                # Возвращаем неудачную пачку, не затирая более свежие изменения
+                self._pending = {**pending, **self._pending}
+                raise
+            finally:
+                self._inflight = {}
+
+    async def flush(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._write_pending()
+
+    # Загрузка при старте
+    async def get_user_data(self):
+        return {int(key): data for key, data in (await self._load(USER)).items()}
+
+    async def get_chat_data(self):
+        return {int(key): data for key, data in (await self._load(CHAT)).items()}
+
+    async def get_bot_data(self):
+        return (await self._load(BOT)).get("", {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        loaded = await self._load(f"conversation:{name}")
+        return {tuple(json.loads(key)): state for key, state in loaded.items()}
+
+    # Сохранение изменений (вызывается приложением раз в update_interval)
+    async def update_user_data(self, user_id, data):
+        self._stage(USER, str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage(CHAT, str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        self._stage(BOT, "", data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        self._stage(f"conversation:{name}", json.dumps(list(key)), new_state)
+
+    async def drop_user_data(self, user_id):
+        self._stage(USER, str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._stage(CHAT, str(chat_id), None)
+
+    # Обновление из базы перед обработкой каждого апдейта
+    async def refresh_user_data(self, user_id, user_data):
+        fresh = await self._refresh(USER, str(user_id))
+        if fresh is not None:
+            user_data.clear()
+            user_data.update(fresh)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        fresh = await self._refresh(CHAT, str(chat_id))
+        if fresh is not None:
+            chat_data.clear()
+            chat_data.update(fresh)
+
+    async def refresh_bot_data(self, bot_data):
+        fresh = await self._refresh(BOT, "")
+        if fresh is not None:
+            bot_data.clear()
+            bot_data.update(fresh)
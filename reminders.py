@@ -0,0 +1,67 @@
+import datetime
+import logging
+import re
+
+import database
+
+TIME_PATTERN = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
+
+
+# Чек-лист: непустые строки файла
+def load_checklist(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+# Разбор времени «ЧЧ:ММ» в слот напоминания, None если формат неверный
+def parse_slot(text):
+    match = TIME_PATTERN.match(text.strip())
+    if not match:
+        return None
+    return f"{int(match.group(1)):02d}:{match.group(2)}"
+
+
+# Ежедневные напоминания по чек-листу. На каждое время («слот») заводится одна
+# задача JobQueue, общая для всех подписчиков этого времени; при срабатывании
+# задачи чек-листа создаются всем подписчикам одной вставкой, а напоминания
+# уходят через очередь исходящих сообщений.
+class ReminderScheduler:
+    def __init__(self, checklist, notifier, timezone):
+        self.checklist = checklist
+        self.notifier = notifier
+        self.timezone = timezone
+        self.job_queue = None
+        self.text = "☀️ Чек-лист на сегодня добавлен в ваши задачи:\n" + "\n".join(checklist)
+
+    async def start(self, job_queue):
+        self.job_queue = job_queue
+        for slot in await database.get_reminder_slots():
+            self._ensure_job(slot)
+
+    def _ensure_job(self, slot):
+        name = f"reminder:{slot}"
+        if self.job_queue.get_jobs_by_name(name):
+            return
+        hour, minute = map(int, slot.split(":"))
+        self.job_queue.run_daily(
+            self._remind, datetime.time(hour, minute, tzinfo=self.timezone), name=name, data=slot
+        )
+
+    async def subscribe(self, chat_id, slot):
+        await database.set_reminder(chat_id, slot)
+        self._ensure_job(slot)
+
+    async def unsubscribe(self, chat_id):
+        await database.delete_reminder(chat_id)
+
+    # Срабатывание слота; слот без подписчиков снимается с расписания
+    async def _remind(self, context):
+        slot = context.job.data
+        chat_ids = await database.get_reminder_subscribers(slot)
+        if not chat_ids:
+            context.job.schedule_removal()
+            return
+        await database.add_tasks([
+            (chat_id, chat_id, item, "accepted") for chat_id in chat_ids for item in self.checklist
+        ])
+        self.notifier.broadcast(chat_ids, self.text)
+        logging.info(f"Напоминание {slot}: {len(chat_ids)} подписчиков")
@@ -0,0 +1,71 @@
+import asyncio
+import datetime
+
+from telegram import Chat, Message, Update
+
+from update_processor import ChatOrderedUpdateProcessor
+
+LIMIT = 2
+CHATS = (101, 102, 103)
+UPDATES_PER_CHAT = 4
+FAILING = (101, 1)   # апдейт, обработчик которого падает
+
+
+# Очередь подачи: чаты вперемешку, но первый чат сначала шлёт два апдейта подряд
+def submissions():
+    order = [(chat_id, number) for number in range(UPDATES_PER_CHAT) for chat_id in CHATS]
+    order.insert(1, order.pop(len(CHATS)))
+    return order
+
+
+def make_update(update_id, chat_id):
+    chat = Chat(chat_id, Chat.PRIVATE)
+    message = Message(update_id, datetime.datetime.now(datetime.timezone.utc), chat, text=str(update_id))
+    return Update(update_id, message=message)
+
+
+# Апдейты трёх чатов вперемешку через process_update, лимит 2:
+# порядок внутри чата, параллельность чатов, лимит и продолжение после ошибки
+async def run_interleaved():
+    processor = ChatOrderedUpdateProcessor(LIMIT)
+    finished = {chat_id: [] for chat_id in CHATS}
+    running = []
+    max_running = 0
+    max_chats = 0
+    max_per_chat = 0
+
+    async def handler(chat_id, number):
+        nonlocal max_running, max_chats, max_per_chat
+        running.append(chat_id)
+        max_running = max(max_running, len(running))
+        max_chats = max(max_chats, len(set(running)))
+        max_per_chat = max(max_per_chat, running.count(chat_id))
+        try:
+            # ранние апдейты дольше поздних: без очереди чата порядок бы нарушился
+            await asyncio.sleep(0.005 * (UPDATES_PER_CHAT - number))
+            finished[chat_id].append(number)
+            if (chat_id, number) == FAILING:
+                raise RuntimeError("сбой обработчика")
+        finally:
+            running.remove(chat_id)
+
+    tasks = []
+    for update_id, (chat_id, number) in enumerate(submissions(), start=1):
+        coroutine = handler(chat_id, number)
+        tasks.append(asyncio.create_task(processor.process_update(make_update(update_id, chat_id), coroutine)))
+        # даём задаче дойти до очереди чата, чтобы порядок подачи был детерминированным
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return finished, max_running, max_chats, max_per_chat, processor
+
+
+def test_chat_ordered_update_processor():
+    finished, max_running, max_chats, max_per_chat, processor = asyncio.run(run_interleaved())
+
+    # все апдейты каждого чата выполнены по порядку, в том числе после упавшего
+    for chat_id in CHATS:
+        assert finished[chat_id] == list(range(UPDATES_PER_CHAT))
+    assert max_per_chat == 1
+    assert max_chats >= 2
+    assert max_running <= LIMIT
+    assert not processor._chats
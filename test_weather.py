@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from weather import WeatherService
+
+CITY = "Moscow"
+
+
+# Заглушка OpenWeather: считает запросы, отвечает с задержкой delay,
+# температура в ответе — номер запроса
+class StubWeather:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+        self.server = None
+
+    async def handle(self, request):
+        self.calls += 1
+        number = self.calls
+        await asyncio.sleep(self.delay)
+        return web.json_response({
+            'main': {'temp': number},
+            'weather': [{'description': "ясно"}],
+            'wind': {'speed': 1},
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/weather", self.handle)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        return str(self.server.make_url("/weather"))
+
+    async def close(self):
+        await self.server.close()
+
+
+async def with_service(stub, check, **options):
+    service = WeatherService("key", base_url=await stub.start(), **options)
+    try:
+        return await check(service)
+    finally:
+        await service.close()
+        await stub.close()
+
+
+# Одновременные запросы одного города — один запрос к API
+def test_concurrent_gets_share_one_request():
+    stub = StubWeather(delay=0.05)
+
+    async def check(service):
+        return await asyncio.gather(*(service.get(CITY) for _ in range(10)))
+
+    results = asyncio.run(with_service(stub, check))
+    assert stub.calls == 1
+    assert all(result['temp'] == 1 for result in results)
+
+
+# Устаревший кэш отдаётся сразу, обновление — одно и в фоне
+def test_stale_read_refreshes_in_background():
+    stub = StubWeather()
+
+    async def check(service):
+        await service.get(CITY)
+        stub.delay = 0.2
+        started = time.perf_counter()
+        results = await asyncio.gather(*(service.get(CITY) for _ in range(5)))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0.05)
+        calls_during_refresh = stub.calls
+        await asyncio.gather(*service._inflight.values())
+        return results, elapsed, calls_during_refresh, service._cache[CITY][1]
+
+    results, elapsed, calls_during_refresh, refreshed = asyncio.run(with_service(stub, check, ttl=0, stale_ttl=60))
+    assert all(result['temp'] == 1 for result in results)
+    assert elapsed < 0.1
+    assert calls_during_refresh == 2
+    assert refreshed['temp'] == 2
+
+
+# Медленный API обрывается по таймауту
+def test_slow_api_times_out():
+    stub = StubWeather(delay=1)
+
+    async def check(service):
+        with pytest.raises(asyncio.TimeoutError):
+            await service.get(CITY)
+
+    asyncio.run(with_service(stub, check, timeout=0.1))
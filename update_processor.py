@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import sys
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+# Параллельная обработка апдейтов с сохранением порядка внутри чата.
+# Апдейты разных чатов обрабатываются одновременно (не больше max_concurrent_updates),
+# апдейты одного чата — строго по очереди: пока чат занят, новые апдейты ждут
+# в его очереди и не занимают слоты других чатов.
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должно быть не меньше 1")
+        # Семафор базового класса берётся до того, как известна очередь чата,
+        # поэтому там ограничения нет, а лимит держим сами после упорядочивания
+        super().__init__(sys.maxsize)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chats = {}   # ключ чата -> очередь ожидающих обработки корутин
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        key = self._chat_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        queue = self._chats.get(key)
+        if queue is not None:
+            # Чат уже обрабатывается: апдейт выполнит тот, кто держит чат
+            queue.append(coroutine)
+            return
+
+        queue = self._chats[key] = deque()
+        try:
+            async with self._slots:
+                while coroutine is not None:
+                    try:
+                        await coroutine
+                    except Exception as e:
+                        logging.error(f"Ошибка обработки апдейта чата {key}: {e}")
+                    coroutine = queue.popleft() if queue else None
+        finally:
+            # При отмене (остановка приложения) закрываем то, что не успели выполнить
+            del self._chats[key]
+            if coroutine is not None:
+                coroutine.close()
+            for pending in queue:
+                pending.close()
+
+    @staticmethod
+    def _chat_key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+        return None
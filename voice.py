@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import speech_recognition as sr
+
+import metrics
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+TRANSCRIPTION_SECONDS = metrics.Histogram(
+    "voice_transcription_seconds", "Время конвертации и распознавания голосового",
+    buckets=(0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+
+class UnrecognizedSpeech(Exception):
+    pass
+
+
+# Конвертация OGG -> PCM (16 кГц, моно, 16 бит) в памяти:
+# ffmpeg читает голосовое из stdin и пишет отсчёты в stdout, без временных файлов
+def convert_to_pcm(ogg_bytes):
+    result = subprocess.run(
+        [FFMPEG_BINARY, "-loglevel", "error", "-i", "pipe:0",
+         "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1"],
+        input=ogg_bytes, capture_output=True, check=True,
+    )
+    return result.stdout
+
+# Движки распознавания: transcribe(pcm) возвращает текст
+# или бросает UnrecognizedSpeech, load() — разовая подготовка движка
+class RecognitionBackend(ABC):
+    name = None
+
+    def load(self):
+        pass
+
+    @abstractmethod
+    def transcribe(self, pcm):
+        pass
+
+
+# Google Speech API (сетевой запрос на каждое сообщение)
+class GoogleBackend(RecognitionBackend):
+    name = "google"
+
+    def __init__(self, language="ru-RU"):
+        self.language = language
+
+    def transcribe(self, pcm):
+        audio = sr.AudioData(pcm, SAMPLE_RATE, SAMPLE_WIDTH)
+        try:
+            return sr.Recognizer().recognize_google(audio, language=self.language)
+        except sr.UnknownValueError:
+            raise UnrecognizedSpeech()
+
+
+# Vosk: офлайн-распознавание, модель загружается один раз и общая для всех потоков
+class VoskBackend(RecognitionBackend):
+    name = "vosk"
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self._model = None
+
+    def load(self):
+        if self._model is not None:
+            return
+        try:
+            import vosk
+        except ImportError:
+            raise RuntimeError("Для SPEECH_BACKEND=vosk установите пакет vosk")
+        if not self.model_path:
+            raise RuntimeError("Не задан путь к модели Vosk (VOSK_MODEL_PATH)")
+        vosk.SetLogLevel(-1)
+        self._model = vosk.Model(self.model_path)
+
+    def transcribe(self, pcm):
+        import vosk
+
+        self.load()
+        recognizer = vosk.KaldiRecognizer(self._model, SAMPLE_RATE)
+        recognizer.AcceptWaveform(pcm)
+        text = json.loads(recognizer.FinalResult()).get("text", "")
+        if not text:
+            raise UnrecognizedSpeech()
+        return text
+
+
+BACKENDS = {backend.name: backend for backend in (GoogleBackend, VoskBackend)}
+
+# Создание движка по имени из настроек
+def create_backend(name, vosk_model_path=None):
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный движок распознавания: {name}")
+    if name == VoskBackend.name:
+        return VoskBackend(vosk_model_path)
+    return BACKENDS[name]()
+
+# Конвертация и распознавание речи (блокирующий вызов, выполняется в пуле)
+def transcribe(backend, ogg_bytes):
+    return backend.transcribe(convert_to_pcm(ogg_bytes))
+
+
+# Очередь распознавания: ограниченная очередь заданий и пул потоков,
+# результат передаётся в callback(result, error) по готовности
+class TranscriptionQueue:
+    def __init__(self, workers=2, max_size=20):
+        self.workers = workers
+        self.max_size = max_size
+        self._queue = None
+        self._executor = None
+        self._tasks = []
+        self._busy = 0
+
+    async def start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(self.max_size)
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="voice")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    # Остановка: даём распознать оставшееся за timeout секунд
+    async def close(self, timeout=10):
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Не дождались распознавания {self._queue.qsize() + self._busy} голосовых")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._queue = self._executor = None
+        self._tasks = []
+
+    def full(self):
+        return self._queue.full()
+
+    # Сколько заданий ждёт свободного потока
+    @property
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    # Постановка задания в очередь, возвращает позицию среди ожидающих
+    # (0 — свободный поток возьмёт задание сразу).
+    # Если очередь заполнена — asyncio.QueueFull
+    def submit(self, func, args, callback):
+        self._queue.put_nowait((func, args, callback))
+        return max(0, self._queue.qsize() - (self.workers - self._busy))
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            func, args, callback = await self._queue.get()
+            self._busy += 1
+            try:
+                started = time.perf_counter()
+                try:
+                    result, error = await loop.run_in_executor(self._executor, func, *args), None
+                except Exception as e:
+                    result, error = None, e
+                TRANSCRIPTION_SECONDS.observe(time.perf_counter() - started)
+                await callback(result, error)
+            except Exception as e:
+                logging.error(f"Ошибка доставки результата распознавания: {e}")
+            finally:
+                self._busy -= 1
+                self._queue.task_done()
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+import metrics
+
+OPENWEATHER_URL = "http://api.openweathermap.org/data/2.5/weather"
+
+WEATHER_REQUESTS = metrics.Counter("weather_requests_total", "Запросы погоды по источнику ответа", ("source",))
+
+
+class WeatherError(Exception):
+    pass
+
+
+# Сервис погоды: одна сессия на приложение, кэш по городу,
+# общий запрос для одновременных вызовов и отдача устаревших данных
+# с обновлением в фоне
+class WeatherService:
+    def __init__(self, api_key, base_url=OPENWEATHER_URL, ttl=600, stale_ttl=3600, timeout=5):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session = None
+        self._cache = {}      # город -> (время получения, данные)
+        self._inflight = {}   # город -> задача текущего запроса
+
+    async def start(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+
+    async def close(self):
+        for task in list(self._inflight.values()):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # Погода по городу: свежий кэш, устаревший кэш + фоновое обновление или запрос
+    async def get(self, city):
+        cached = self._cache.get(city)
+        if cached:
+            age = time.monotonic() - cached[0]
+            if age < self.ttl:
+                WEATHER_REQUESTS.inc(source="cache")
+                return cached[1]
+            if age < self.stale_ttl:
+                WEATHER_REQUESTS.inc(source="stale")
+                self._refresh(city)
+                return cached[1]
+        WEATHER_REQUESTS.inc(source="api")
+        # shield: отмена одного ожидающего не обрывает общий запрос
+        return await asyncio.shield(self._refresh(city))
+
+    # Запуск запроса к API, если для города он ещё не выполняется
+    def _refresh(self, city):
+        task = self._inflight.get(city)
+        if task is None:
+            task = asyncio.create_task(self._fetch(city))
+            self._inflight[city] = task
+            task.add_done_callback(lambda done: self._on_done(city, done))
+        return task
+
+    def _on_done(self, city, task):
+        self._inflight.pop(city, None)
+        if not task.cancelled() and task.exception():
+            logging.warning(f"Не удалось обновить погоду для {city}: {task.exception()!r}")
+
+    @metrics.timed(metrics.OUTBOUND_SECONDS, service="openweather")
+    async def _fetch(self, city):
+        await self.start()
+        params = {"q": city, "appid": self.api_key, "units": "metric", "lang": "ru"}
+        async with self._session.get(self.base_url, params=params) as response:
+            if response.status != 200:
+                raise WeatherError(f"Ошибка погоды: код {response.status}")
+            data = await response.json()
+        weather = {
+            'temp': data['main']['temp'],
+            'description': data['weather'][0]['description'],
+            'wind': data['wind']['speed'],
+        }
+        self._cache[city] = (time.monotonic(), weather)
+        return weather